@@ -0,0 +1,319 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    A thread-safe key / value store persisted in a SQLite database
+
+    Values must be JSON serializable. Each entry may be stored along with a
+    ``token`` describing the state it was computed from (e.g. a repository's
+    last modified timestamp), in which case a lookup only hits if it passes
+    the same token.
+
+    Several caches can share one database file by using different tables.
+
+    If ``max_entries`` is given, the least recently used entries are evicted
+    to keep the table within that many entries. Once it is full, a tenth of
+    the entries are evicted at a time. If ``max_age`` is given, entries
+    last used more than that many seconds ago are deleted when it is opened.
+    """
+
+    def __init__(self, path, table="cache", max_entries=None, max_age=None):
+        if not table.isidentifier():
+            raise ValueError("Invalid cache table name: %s" % table)
+
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS %s "  # nosec
+                "(key TEXT PRIMARY KEY, token TEXT, value TEXT, updated REAL, "
+                "accessed REAL)" % table
+            )
+            columns = [
+                row[1]
+                for row in self._db.execute("PRAGMA table_info(%s)" % table)  # nosec
+            ]
+            if "accessed" not in columns:
+                # Tables created before entries were evicted
+                self._db.execute(
+                    "ALTER TABLE %s ADD COLUMN accessed REAL" % table  # nosec
+                )
+            if max_age is not None:
+                expired = self._db.execute(
+                    "DELETE FROM %s "  # nosec
+                    "WHERE COALESCE(accessed, updated) < ?" % table,
+                    (time.time() - max_age,),
+                ).rowcount
+                if expired:
+                    logger.debug("Pruned %d expired entries from %s", expired, table)
+            # Kept up to date by set(), so it needs no query per entry
+            (self._count,) = self._db.execute(
+                "SELECT COUNT(*) FROM %s" % table  # nosec
+            ).fetchone()
+
+        logger.debug("Opened cache: path=%s table=%s", path, table)
+
+    def get(self, key, token=None, default=None, max_age=None):
+        """
+        Returns the value stored for ``key``, or ``default`` on a miss
+
+        If ``max_age`` is given, entries stored more than that many seconds
+        ago are treated as misses.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT token, value, updated FROM %s WHERE key = ?"  # nosec
+                % self.table,
+                (key,),
+            ).fetchone()
+
+            if row is None or row[0] != json.dumps(token):
+                self.misses += 1
+                return default
+
+            if max_age is not None and time.time() - row[2] > max_age:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            if self.max_entries is not None or self.max_age is not None:
+                with self._db:
+                    self._db.execute(
+                        "UPDATE %s SET accessed = ? WHERE key = ?"  # nosec
+                        % self.table,
+                        (time.time(), key),
+                    )
+            return json.loads(row[1])
+
+    def set(self, key, value, token=None):
+        """
+        Stores ``value`` for ``key``, replacing any existing entry
+        """
+        now = time.time()
+        with self._lock, self._db:
+            updated = self._db.execute(
+                "UPDATE %s SET token = ?, value = ?, updated = ?, accessed = ? "  # nosec
+                "WHERE key = ?" % self.table,
+                (json.dumps(token), json.dumps(value), now, now, key),
+            ).rowcount
+            if not updated:
+                self._db.execute(
+                    "INSERT INTO %s "  # nosec
+                    "(key, token, value, updated, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)" % self.table,
+                    (key, json.dumps(token), json.dumps(value), now, now),
+                )
+                self._count += 1
+
+            if self.max_entries is not None and self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries, down to 90% of ``max_entries``
+        """
+        excess = self._count - self.max_entries * 9 // 10
+        deleted = self._db.execute(
+            "DELETE FROM %s WHERE key IN ("  # nosec
+            "SELECT key FROM %s ORDER BY COALESCE(accessed, updated) LIMIT ?)"
+            % (self.table, self.table),
+            (excess,),
+        ).rowcount
+        self._count -= deleted
+        self.evictions += deleted
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __str__(self):
+        if self.max_entries is not None:
+            return "%s: hits=%d misses=%d evictions=%d" % (
+                self.table,
+                self.hits,
+                self.misses,
+                self.evictions,
+            )
+        return "%s: hits=%d misses=%d" % (self.table, self.hits, self.misses)
+
+
+class EntityCache:
+    """
+    A thread-safe in-memory cache of API documents shared between projects
+
+    Documents such as the owner of many repositories are fetched once per
+    run, no matter how many repositories refer to them. Misses count the
+    documents actually fetched. If a ``disk`` cache
+    (a DiskCache) is given, documents are also kept across runs for up to
+    ``ttl`` seconds.
+    """
+
+    def __init__(self, disk=None, ttl=None):
+        self.disk = disk
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, fetch):
+        """
+        Returns the document cached for ``key``, calling ``fetch()`` on a miss
+
+        Concurrent lookups of the same key wait for a single fetch.
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key]
+
+            value = None
+            if self.disk is not None:
+                value = self.disk.get(key, max_age=self.ttl)
+
+            fetched = value is None
+            if fetched:
+                value = fetch()
+                if self.disk is not None:
+                    self.disk.set(key, value)
+
+            with self._lock:
+                self._entries[key] = value
+                if fetched:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+            return value
+
+    def __str__(self):
+        return "entities: hits=%d misses=%d" % (self.hits, self.misses)
+
+
+class ConditionalCache:
+    """
+    Responses stored for conditional HTTP requests, and their statistics
+
+    Shared by the ConditionalCacheAdapter instances mounted on each session,
+    so hits and misses are totalled across all of them.
+    """
+
+    def __init__(self, disk):
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __str__(self):
+        return "http: not modified=%d fetched=%d" % (self.hits, self.misses)
+
+
+class ConditionalCacheAdapter(HTTPAdapter):
+    """
+    A requests transport adapter revalidating GET responses with ETags
+
+    Responses carrying an ``ETag`` or ``Last-Modified`` header are stored in
+    a ConditionalCache. Later requests for the same URL send them back as
+    ``If-None-Match`` / ``If-Modified-Since``, and a ``304 Not Modified``
+    answer is replaced with the stored response. GitHub does not count 304
+    responses against the rate limit.
+
+    See: https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api#use-conditional-requests-if-appropriate
+    """
+
+    # Answers that must always be fresh
+    uncached_paths = ("/rate_limit",)
+
+    def __init__(self, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    @staticmethod
+    def _key(request):
+        # Not keyed on the credentials, so the tokens of a TokenPool share
+        # entries. A stored response is only reused after GitHub answers 304
+        # to its ETag for the credentials in use, so none is served to a
+        # token that would have been answered differently.
+        return "%s\n%s" % (request.url, request.headers.get("Accept", ""))
+
+    def send(self, request, stream=False, **kwargs):
+        if (
+            request.method != "GET"
+            or stream
+            or request.path_url.split("?")[0].endswith(self.uncached_paths)
+        ):
+            return super().send(request, stream=stream, **kwargs)
+
+        key = self._key(request)
+        entry = self.cache.disk.get(key)
+        if entry is not None:
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.count(hit=True)
+            # Keep the fresh headers (e.g. rate limits) over the stored ones
+            headers = dict(entry["headers"])
+            headers.update(response.headers)
+            response.headers.clear()
+            response.headers.update(headers)
+            response.status_code = entry["status"]
+            response._content = base64.b64decode(entry["body"])
+            return response
+
+        self.cache.count(hit=False)
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            self.cache.disk.set(
+                key,
+                {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "status": response.status_code,
+                    "headers": dict(response.headers),
+                    "body": base64.b64encode(response.content).decode("ascii"),
+                },
+            )
+
+        return response
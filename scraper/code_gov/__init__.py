@@ -1,21 +1,632 @@
 #! /usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
+import os
+import queue
+import sys
+import threading
 
-from scraper import bitbucket, doecode, github, gitlab, tfs
+from dateutil.parser import parse as date_parse
+
+from scraper import bitbucket, doecode, github, gitlab, sloc, tfs
 from scraper.azuredevops import AzureDevOpsClient
+from scraper.cache import ConditionalCache, DiskCache, EntityCache
+from scraper.code_gov.journal import Journal
 from scraper.code_gov.models import Metadata, Project
-from scraper.github import gov_orgs
+from scraper.github import aio, gov_orgs
+from scraper.github.crawl import RepositoryCrawl
+from scraper.util import ScratchSpace, labor_hours_from_url, ordered_map
 
 logger = logging.getLogger(__name__)
 
+# Marks the end of the releases an instance task puts on its queue
+_DONE = object()
 
-def process_config(config):
+# Number of releases an instance task may produce ahead of the one being
+# yielded, after which it waits for its turn
+_QUEUE_SIZE = 100
+
+
+def _project(record):
     """
-    Master function to process a Scraper config file
+    Returns a Project holding a release record loaded from disk
+    """
+    project = Project()
+    project.clear()
+    project.update(record)
+    return project
 
-    Returns a Code.gov Metadata file
+
+class _Run:
+    """
+    Settings and shared state for a single pass over a Scraper config file
+    """
+
+    def __init__(self, config):
+        self.compute_labor_hours = config.get("compute_labor_hours", True)
+
+        # Number of repositories to enrich concurrently, may be overridden per instance
+        self.jobs = config.get("jobs", 1)
+        logger.debug("Jobs: %s", self.jobs)
+
+        self.project_cache = None
+        self.sloc_cache = None
+        self.entity_cache = EntityCache()
+        self.http_cache = None
+        self.node_cache = None
+        cache_path = config.get("cache_path", None)
+        if cache_path:
+            logger.debug("Cache Path: %s", cache_path)
+            # Entries not used for a month are dropped (e.g. those of
+            # deleted repositories), so the file does not grow without bound
+            max_age = config.get("cache_max_age", 30 * 24 * 60 * 60)
+            cache = functools.partial(DiskCache, cache_path, max_age=max_age)
+            self.project_cache = cache("projects")
+            self.sloc_cache = cache("sloc")
+            # Shared documents (e.g. repository owners) are kept across runs for a day
+            self.entity_cache = EntityCache(
+                cache("entities"),
+                ttl=config.get("entity_cache_ttl", 24 * 60 * 60),
+            )
+            # GitHub API responses, revalidated with conditional requests
+            self.http_cache = ConditionalCache(cache("http"))
+            # GraphQL node ids of known GitHub repositories
+            self.node_cache = cache("github_nodes")
+
+        self.journal = None
+        journal_path = config.get("journal_path", None)
+        if journal_path:
+            logger.debug("Journal Path: %s", journal_path)
+            self.journal = Journal(journal_path, resume=config.get("resume", False))
+
+        # Labor hours are computed on their own pool, so that cloning and
+        # counting repositories does not hold up the metadata enrichment
+        self.labor_hours_pool = None
+        self.scratch = None
+        if self.compute_labor_hours:
+            # Same default as ThreadPoolExecutor, resolved here to size scratch space
+            workers = config.get("labor_hours_jobs", self.jobs) or min(
+                32, (os.cpu_count() or 1) + 4
+            )
+            logger.debug("Labor Hours Jobs: %s", workers)
+            self.labor_hours_pool = ThreadPoolExecutor(max_workers=workers)
+
+            scratch_limit_mb = config.get("scratch_limit_mb", None)
+            self.scratch = ScratchSpace(
+                config.get("scratch_dir", None),
+                limit_mb=scratch_limit_mb,
+                default_mb=scratch_limit_mb and scratch_limit_mb / workers,
+            )
+
+        self.sloc_counter = None
+        if self.compute_labor_hours:
+            sloc_counter = config.get("sloc_counter", "cloc")
+            logger.debug("SLOC Counter: %s", sloc_counter)
+            if sloc_counter == "builtin":
+                self.sloc_counter = sloc.Counter(config.get("sloc_jobs", None))
+            elif sloc_counter != "cloc":
+                raise ValueError("Unknown sloc_counter: %s" % sloc_counter)
+
+        # "archive" streams files out of a bare clone instead of checking them out
+        self.sloc_clone_mode = config.get("sloc_clone_mode", "checkout")
+        if self.sloc_clone_mode == "archive" and self.sloc_counter is None:
+            raise ValueError(
+                "sloc_clone_mode 'archive' requires sloc_counter 'builtin'"
+            )
+
+    def close(self):
+        if self.labor_hours_pool is not None:
+            self.labor_hours_pool.shutdown()
+
+        if self.sloc_counter is not None:
+            self.sloc_counter.close()
+
+        for cache in (self.project_cache, self.sloc_cache, self.node_cache):
+            if cache is not None:
+                logger.info("Cache %s", cache)
+                cache.close()
+
+        logger.info("Cache %s", self.entity_cache)
+        if self.entity_cache.disk is not None:
+            self.entity_cache.disk.close()
+
+        if self.http_cache is not None:
+            logger.info("Cache %s", self.http_cache)
+            self.http_cache.disk.close()
+
+        if self.journal is not None:
+            self.journal.close()
+
+    def releases(self, instance, build, items, key=None, labor_hours=False, size=None):
+        """
+        Yields the Projects built from ``items`` by ``build``, in order
+
+        Each Project is yielded along with a Future for its pending labor
+        hours computation (or None), which must be waited on before the
+        Project is complete.
+
+        If ``labor_hours`` is True and labor hours are being computed for
+        this run, the ``laborHours`` of each built Project is computed in the
+        background from its ``repositoryURL``. ``size`` may return an
+        estimate, in bytes, of the disk space needed to clone an item.
+
+        ``key`` returns a ``(key, token)`` pair identifying an item and its
+        current state (e.g. a last modified timestamp), or None as the token
+        if the source has no such state. Releases already recorded in the
+        journal of an interrupted run are replayed as is. Otherwise, when a
+        Project was cached for the same key and token on a previous run,
+        that record is reused instead of building it again.
+        """
+        jobs = instance.get("jobs", self.jobs)
+        labor_hours = labor_hours and self.compute_labor_hours
+
+        build = functools.partial(self._build, build, key, labor_hours, size)
+
+        return ordered_map(build, items, jobs)
+
+    def _build(self, build, key_func, labor_hours, size_func, item):
+        key, token = (None, None) if key_func is None else key_func(item)
+
+        project, cache_token = self.replay(key, token)
+        if project is not None:
+            return project, None
+
+        project = build(item)
+
+        size = None if size_func is None or not labor_hours else size_func(item)
+        return self.complete(project, key, cache_token, labor_hours, size)
+
+    def replay(self, key, token):
+        """
+        Returns a previously built Project for an item's key and token, if any
+
+        Returns a ``(project, cache_token)`` pair, where ``project`` is None if
+        the item needs to be built, and ``cache_token`` is to be passed on to
+        ``complete()`` once it is.
+        """
+        if key is not None and self.journal is not None:
+            record = self.journal.get(key)
+            if record is not None:
+                logger.debug("Replaying release from journal: %s", key)
+                return _project(record), None
+
+        cache_token = None
+        if key is not None and token is not None and self.project_cache is not None:
+            cache_token = [token, self.compute_labor_hours]
+            record = self.project_cache.get(key, cache_token)
+            if record is not None:
+                logger.info("Using cached release: %s", key)
+                return _project(record), None
+
+        return None, cache_token
+
+    def complete(self, project, key, cache_token, labor_hours, size=None):
+        """
+        Records a newly built Project, computing its labor hours if needed
+
+        Returns the Project along with a Future for its pending labor hours
+        computation (or None), as ``releases()`` yields them.
+        """
+        if not (labor_hours and self.compute_labor_hours):
+            self._record(key, cache_token, project)
+            return project, None
+
+        pending = self.labor_hours_pool.submit(
+            self._labor_hours, project, key, cache_token, size
+        )
+        return project, pending
+
+    def _labor_hours(self, project, key, cache_token, size):
+        url = project.get("repositoryURL")
+        if not url:
+            # Nothing to clone, the release keeps its laborHours of 0
+            logger.debug("No repositoryURL to compute labor hours: %s", key)
+            self._record(key, cache_token, project)
+            return
+
+        try:
+            project["laborHours"] = labor_hours_from_url(
+                url,
+                sloc_cache=self.sloc_cache,
+                scratch=self.scratch,
+                size=size,
+                sloc_counter=self.sloc_counter,
+                clone_mode=self.sloc_clone_mode,
+            )
+        except Exception:
+            # Leave the release unrecorded, so it is retried on the next run
+            logger.exception("Failed to compute labor hours: url=%s", url)
+            return
+
+        self._record(key, cache_token, project)
+
+    def _record(self, key, cache_token, project):
+        if key is None:
+            return
+
+        if cache_token is not None:
+            self.project_cache.set(key, project, cache_token)
+        if self.journal is not None:
+            self.journal.append(key, project)
+
+
+def _github_included(repo, excluded):
+    if repo.owner.login in excluded or repo.full_name in excluded:
+        logger.info("Excluding: %s", repo.full_name)
+        return False
+    return True
+
+
+def _github_json_included(repo, excluded):
+    if repo["owner"]["login"] in excluded or repo["full_name"] in excluded:
+        logger.info("Excluding: %s", repo["full_name"])
+        return False
+    return True
+
+
+def _github_graphql_included(repo, excluded):
+    if repo["owner"]["login"] in excluded or repo["nameWithOwner"] in excluded:
+        logger.info("Excluding: %s", repo["nameWithOwner"])
+        return False
+    return True
+
+
+def _gitlab_included(repo, excluded):
+    namespace = repo.namespace["path"]
+    path_with_namespace = repo.path_with_namespace
+    if namespace in excluded or path_with_namespace in excluded:
+        logger.info("Excluding: %s", repo.path_with_namespace)
+        return False
+    return True
+
+
+def _bitbucket_included(repo, excluded):
+    project = repo["project"]["key"]
+    project_repo = "%s/%s" % (project, repo["slug"])
+    if project in excluded or project_repo in excluded:
+        logger.info("Excluding: %s", project_repo)
+        return False
+    return True
+
+
+def _ado_included(project, excluded):
+    if project.project_name in excluded:
+        logger.info("Excluding: %s", project.project_name)
+        return False
+    return True
+
+
+def _github_releases(instance, run):
+    """
+    Yields the Code.gov releases for a single GitHub instance config
+    """
+    timeouts = {}
+    url = instance.get("url", "https://github.com")
+    orgs = instance.get("orgs", [])
+    repos = instance.get("repos", [])
+    public_only = instance.get("public_only", True)
+    org_jobs = instance.get("org_jobs", 1)
+    excluded = instance.get("exclude", [])
+    # A list of "tokens" is used as a pool, picking the least used token
+    token = instance.get("tokens", None) or instance.get("token", None)
+    connect_timeout = instance.get("connect_timeout", None)
+    read_timeout = instance.get("read_timeout", None)
+
+    if connect_timeout is not None:
+        timeouts["default_connect_timeout"] = connect_timeout
+    if read_timeout is not None:
+        timeouts["default_read_timeout"] = read_timeout
+
+    if instance.get("backend", "sync") == "async":
+        yield from _github_async_releases(instance, run, url, token, timeouts)
+        return
+
+    gh_session = github.connect(url, token, timeouts, run.http_cache)
+
+    graphql = instance.get("graphql", False)
+    if graphql and not (orgs or repos):
+        logger.warning("GraphQL can't list all repositories, using the REST API")
+
+    crawl = None
+    crawl_state_dir = instance.get("crawl_state_dir", None)
+    if crawl_state_dir and not (orgs or repos):
+        crawl = RepositoryCrawl(
+            gh_session,
+            crawl_state_dir,
+            partitions=instance.get("crawl_partitions", 16),
+            jobs=instance.get("crawl_jobs", 4),
+            worker=instance.get("crawl_worker", (0, 1)),
+        )
+
+    if graphql and (orgs or repos):
+        gh_repos = (
+            repo
+            for repo in github.query_repos_graphql(
+                gh_session,
+                orgs,
+                repos,
+                public_only,
+                org_jobs,
+                node_cache=run.node_cache,
+                ttl=run.entity_cache.ttl,
+            )
+            if _github_graphql_included(repo, excluded)
+        )
+        code_gov_projects = run.releases(
+            instance,
+            functools.partial(
+                Project.from_github_graphql,
+                labor_hours=False,
+                api_url=gh_session.session.base_url,
+            ),
+            gh_repos,
+            key=lambda repo: (
+                "GitHub:%s:%s" % (url, repo["databaseId"]),
+                _github_token(repo["pushedAt"], repo["updatedAt"]),
+            ),
+            labor_hours=True,
+            size=lambda repo: (repo["diskUsage"] or 0) * 1024,
+        )
+    else:
+        gh_repos = (
+            repo
+            for repo in github.query_repos(
+                gh_session, orgs, repos, public_only, org_jobs, crawl
+            )
+            if _github_included(repo, excluded)
+        )
+        code_gov_projects = run.releases(
+            instance,
+            functools.partial(
+                Project.from_github3, labor_hours=False, entity_cache=run.entity_cache
+            ),
+            gh_repos,
+            key=lambda repo: (
+                "GitHub:%s:%s" % (url, repo.id),
+                [str(repo.pushed_at), str(repo.updated_at)],
+            ),
+            labor_hours=True,
+            # The reported repository size (in KB) approximates a shallow clone
+            size=lambda repo: repo.size * 1024,
+        )
+
+    try:
+        yield from code_gov_projects
+    finally:
+        if isinstance(token, list):
+            logger.info("GitHub (%s) %s", url, gh_session.session.auth)
+
+
+def _github_token(*timestamps):
+    """
+    Returns the cache token of a repository from its ISO 8601 timestamps
+
+    They are formatted as github3.py parses them, so that a repository
+    cached by one GitHub backend is replayed by the others.
+    """
+    return [
+        str(date_parse(timestamp) if timestamp else None) for timestamp in timestamps
+    ]
+
+
+def _github_async_releases(instance, run, url, token, timeouts):
+    """
+    Yields the Code.gov releases for a GitHub instance using the async backend
+    """
+    excluded = instance.get("exclude", [])
+    if isinstance(token, list):
+        logger.warning("The async GitHub backend uses only the first of the tokens")
+        token = token[0]
+
+    def prepare(repo):
+        if not _github_json_included(repo, excluded):
+            return False, None
+
+        key = "GitHub:%s:%s" % (url, repo["id"])
+        project, cache_token = run.replay(
+            key, _github_token(repo["pushed_at"], repo["updated_at"])
+        )
+        # Only repositories that are not cached need their documents fetched
+        return project is None, (key, cache_token, project)
+
+    for repo, state, documents in aio.iter_documents(
+        url,
+        token,
+        instance.get("orgs", []),
+        instance.get("repos", []),
+        instance.get("public_only", True),
+        prepare=prepare,
+        max_in_flight=instance.get("max_in_flight", 100),
+        timeouts=timeouts,
+    ):
+        if state is None:
+            continue
+
+        key, cache_token, project = state
+        if project is not None:
+            yield project, None
+            continue
+
+        logger.info("Processing: %s", repo["full_name"])
+        project = Project.from_github_json(repo, labor_hours=False, **documents)
+        # The reported repository size (in KB) approximates a shallow clone
+        yield run.complete(
+            project, key, cache_token, labor_hours=True, size=repo["size"] * 1024
+        )
+
+
+def _gitlab_releases(instance, run):
+    """
+    Yields the Code.gov releases for a single GitLab instance config
+    """
+    url = instance.get("url")
+    # orgs = instance.get('orgs', [])
+    repos = instance.get("repos", [])
+    # public_only = instance.get('public_only', True)
+    excluded = instance.get("exclude", [])
+    token = instance.get("token", None)
+    fetch_languages = instance.get("fetch_languages", False)
+
+    gl_session = gitlab.connect(url, token)
+
+    gl_repos = (
+        repo
+        for repo in gitlab.query_repos(gl_session, repos)
+        if _gitlab_included(repo, excluded)
+    )
+    code_gov_projects = run.releases(
+        instance,
+        functools.partial(
+            Project.from_gitlab,
+            labor_hours=False,
+            fetch_languages=fetch_languages,
+        ),
+        gl_repos,
+        key=lambda repo: (
+            "GitLab:%s:%s" % (url, repo.id),
+            [repo.last_activity_at, fetch_languages],
+        ),
+        labor_hours=True,
+    )
+    yield from code_gov_projects
+
+
+def _bitbucket_releases(instance, run):
+    """
+    Yields the Code.gov releases for a single Bitbucket instance config
+    """
+    url = instance.get("url")
+    # orgs = instance.get('orgs', None)
+    # public_only = instance.get('public_only', True)
+    username = instance.get("username", None)
+    password = instance.get("password", None)
+    token = instance.get("token", None)
+    excluded = instance.get("exclude", [])
+
+    bb_session = bitbucket.connect(url, username, password, token)
+
+    bb_repos = (
+        repo
+        for repo in bitbucket.all_repos(bb_session)
+        if _bitbucket_included(repo, excluded)
+    )
+    code_gov_projects = run.releases(
+        instance,
+        functools.partial(Project.from_stashy, labor_hours=False),
+        bb_repos,
+        key=lambda repo: (
+            "Bitbucket:%s:%s/%s" % (url, repo["project"]["key"], repo["slug"]),
+            None,
+        ),
+        labor_hours=True,
+    )
+    yield from code_gov_projects
+
+
+def _tfs_releases(instance, run):
+    """
+    Yields the Code.gov releases for a single TFS instance config
+    """
+    url = instance.get("url")
+    token = instance.get("token", None)
+
+    projects = tfs.get_projects_metadata(url, token)
+    code_gov_projects = run.releases(
+        instance,
+        functools.partial(Project.from_tfs, labor_hours=run.compute_labor_hours),
+        projects,
+        key=lambda project: ("TFS:%s:%s" % (url, project.projectInfo.id), None),
+    )
+    yield from code_gov_projects
+
+
+def _ado_releases(instance, run):
+    """
+    Yields the Code.gov releases for a single AzureDevOps instance config
+    """
+    url = instance.get("url")
+    token = instance.get("token", None)
+    api_version = instance.get("apiVersion", "6.1-preview")
+    excluded = instance.get("exclude", [])
+
+    ado_client = AzureDevOpsClient(url, api_version, token)
+    projects = (
+        project
+        for project in ado_client.get_projects_metadata()
+        if _ado_included(project, excluded)
+    )
+    code_gov_projects = run.releases(
+        instance,
+        functools.partial(Project.from_ado, labor_hours=run.compute_labor_hours),
+        projects,
+        key=lambda project: (
+            "AzureDevOps:%s:%s" % (url, project.project_id),
+            project.project_last_update_time,
+        ),
+    )
+    yield from code_gov_projects
+
+
+def _doecode_releases(doecode_config, run):
+    """
+    Yields the Code.gov releases for the DOE CODE config
+    """
+    doecode_json = doecode_config.get("json", None)
+    doecode_url = doecode_config.get("url", None)
+    doecode_key = doecode_config.get("api_key", None)
+
+    records = doecode.process(doecode_json, doecode_url, doecode_key)
+    code_gov_projects = run.releases(
+        doecode_config,
+        Project.from_doecode,
+        records,
+        key=lambda record: (
+            "DOE CODE:%s" % record["code_id"] if "code_id" in record else None,
+            None,
+        ),
+    )
+    yield from code_gov_projects
+
+
+def _put(releases, item, stopped):
+    """
+    Puts an item onto a bounded queue, unless ``stopped`` is set first
+
+    Returns False if it was stopped.
+    """
+    while not stopped.is_set():
+        try:
+            releases.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(func, releases, stopped):
+    """
+    Runs an instance task, putting each (release, pending) pair it yields
+    onto a queue, followed by ``(_DONE, error)`` once it ends
+
+    The task is abandoned if ``stopped`` is set while it waits for room.
+    """
+    error = None
+    try:
+        for release in func():
+            if not _put(releases, release, stopped):
+                return
+    except Exception as exc:  # Re-raised in the consumer's thread
+        error = exc
+    finally:
+        _put(releases, (_DONE, error), stopped)
+
+
+def create_metadata(config):
+    """
+    Returns an empty Code.gov Metadata file for a Scraper config file
     """
 
     agency = config.get("agency", "UNKNOWN")
@@ -24,148 +635,143 @@ def process_config(config):
     method = config.get("method", "other")
     logger.debug("Inventory Method: %s", method)
 
-    compute_labor_hours = config.get("compute_labor_hours", True)
-
     if config.get("contact_email", None) is None:
         # A default contact email is required to handle the (frequent) case
         # where a project / repository has no available contact email.
         logger.warning('Config file should contain a "contact_email"')
 
     logger.debug("Creating inventory from config: %s", config)
-    code_gov_metadata = Metadata(agency, method)
+    return Metadata(agency, method)
 
-    # Parse config for GitHub repositories
-    github_instances = config.get("GitHub", [])
-    if config.get("github_gov_orgs", False):
-        github_instances.append({"url": "https://github.com", "orgs": gov_orgs()})
-    for instance in github_instances:
-        timeouts = {}
-        url = instance.get("url", "https://github.com")
-        orgs = instance.get("orgs", [])
-        repos = instance.get("repos", [])
-        public_only = instance.get("public_only", True)
-        excluded = instance.get("exclude", [])
-        token = instance.get("token", None)
-        connect_timeout = instance.get("connect_timeout", None)
-        read_timeout = instance.get("read_timeout", None)
-
-        if connect_timeout is not None:
-            timeouts["default_connect_timeout"] = connect_timeout
-        if read_timeout is not None:
-            timeouts["default_read_timeout"] = read_timeout
-
-        gh_session = github.connect(url, token, timeouts)
-
-        for repo in github.query_repos(gh_session, orgs, repos, public_only):
-            if repo.owner.login in excluded or repo.full_name in excluded:
-                logger.info("Excluding: %s", repo.full_name)
-                continue
 
-            code_gov_project = Project.from_github3(
-                repo, labor_hours=compute_labor_hours
-            )
-            code_gov_metadata["releases"].append(code_gov_project)
-
-    # Parse config for GitLab repositories
-    gitlab_instances = config.get("GitLab", [])
-    for instance in gitlab_instances:
-        url = instance.get("url")
-        # orgs = instance.get('orgs', [])
-        repos = instance.get("repos", [])
-        # public_only = instance.get('public_only', True)
-        excluded = instance.get("exclude", [])
-        token = instance.get("token", None)
-        fetch_languages = instance.get("fetch_languages", False)
-
-        gl_session = gitlab.connect(url, token)
-
-        for repo in gitlab.query_repos(gl_session, repos):
-            namespace = repo.namespace["path"]
-            path_with_namespace = repo.path_with_namespace
-            if namespace in excluded or path_with_namespace in excluded:
-                logger.info("Excluding: %s", repo.path_with_namespace)
-                continue
+def iter_releases(config, failed=None):
+    """
+    Yields the Code.gov releases for every instance in a Scraper config file
+
+    Every configured instance is processed as its own independent task, so
+    a slow or failing instance does not hold up (or abort) the others. The
+    releases are yielded in config order: GitHub, GitLab, Bitbucket, TFS,
+    AzureDevOps and finally DOE CODE. Releases of the instance currently
+    being yielded are passed through as soon as they are produced, while
+    instances further down the list pause once they have queued up a
+    bounded number of releases, until their turn.
+
+    The names of instances that fail are appended to ``failed``, if given.
+    Releases an instance produced before failing have already been yielded
+    by then.
+    """
 
-            code_gov_project = Project.from_gitlab(
-                repo, labor_hours=compute_labor_hours, fetch_languages=fetch_languages
-            )
-            code_gov_metadata["releases"].append(code_gov_project)
-
-    # Parse config for Bitbucket repositories
-    bitbucket_instances = config.get("Bitbucket", [])
-    for instance in bitbucket_instances:
-        url = instance.get("url")
-        # orgs = instance.get('orgs', None)
-        # public_only = instance.get('public_only', True)
-        username = instance.get("username", None)
-        password = instance.get("password", None)
-        token = instance.get("token", None)
-        excluded = instance.get("exclude", [])
-
-        bb_session = bitbucket.connect(url, username, password, token)
-
-        for repo in bitbucket.all_repos(bb_session):
-            project = repo["project"]["key"]
-            project_repo = "%s/%s" % (project, repo["slug"])
-            if project in excluded or project_repo in excluded:
-                logger.info("Excluding: %s", project_repo)
-                continue
+    run = _Run(config)
 
-            code_gov_project = Project.from_stashy(
-                repo, labor_hours=compute_labor_hours
-            )
-            code_gov_metadata["releases"].append(code_gov_project)
-
-    # Parse config for TFS repositories
-    tfs_instances = config.get("TFS", [])
-    for instance in tfs_instances:
-        url = instance.get("url")
-        token = instance.get("token", None)
-
-        projects = tfs.get_projects_metadata(url, token)
-        for project in projects:
-            code_gov_project = Project.from_tfs(
-                project, labor_hours=compute_labor_hours
+    github_instances = config.get("GitHub", [])
+    if config.get("github_gov_orgs", False):
+        # The organization list is kept with the other shared documents
+        orgs = gov_orgs(run.entity_cache.disk, run.entity_cache.ttl)
+        github_instances.append(
+            {
+                "url": "https://github.com",
+                "orgs": orgs,
+                "org_jobs": config.get("github_gov_orgs_jobs", 8),
+                "tokens": config.get("github_gov_orgs_tokens", None),
+            }
+        )
+
+    sources = [
+        ("GitHub", github_instances, _github_releases, "https://github.com"),
+        ("GitLab", config.get("GitLab", []), _gitlab_releases, None),
+        ("Bitbucket", config.get("Bitbucket", []), _bitbucket_releases, None),
+        ("TFS", config.get("TFS", []), _tfs_releases, None),
+        ("AzureDevOps", config.get("AzureDevOps", []), _ado_releases, None),
+    ]
+
+    tasks = []
+    for source, instances, func, default_url in sources:
+        for instance in instances:
+            name = "%s (%s)" % (source, instance.get("url", default_url))
+            tasks.append((name, functools.partial(func, instance, run)))
+
+    doecode_config = config.get("DOE CODE", {})
+    tasks.append(
+        ("DOE CODE", functools.partial(_doecode_releases, doecode_config, run))
+    )
+
+    # Set when the releases stop being consumed, to release blocked tasks
+    stopped = threading.Event()
+    threads = []
+    try:
+        for name, func in tasks:
+            releases = queue.Queue(maxsize=_QUEUE_SIZE)
+            # A daemon, so that releases abandoned without being closed (e.g.
+            # by an error escaping the caller) don't keep the process alive
+            thread = threading.Thread(
+                target=_drain, args=(func, releases, stopped), name=name, daemon=True
             )
-            code_gov_metadata["releases"].append(code_gov_project)
-
-    # parse config for AzureDevOps repositories
-    ado_instances = config.get("AzureDevOps", [])
-    for instance in ado_instances:
-        url = instance.get("url")
-        token = instance.get("token", None)
-        api_version = instance.get("apiVersion", "6.1-preview")
-        excluded = instance.get("exclude", [])
-
-        ado_client = AzureDevOpsClient(url, api_version, token)
-        projects = ado_client.get_projects_metadata()
-        for project in projects:
-            if project.project_name in excluded:
-                logger.info("Excluding: %s", project.project_name)
+            thread.start()
+            threads.append((name, releases, thread))
+
+        for name, releases, _ in threads:
+            count = 0
+            while True:
+                item = releases.get()
+                if item[0] is _DONE:
+                    error = item[1]
+                    break
+
+                release, pending = item
+                if pending is not None:
+                    # Wait for its laborHours to be filled in
+                    pending.result()
+                count += 1
+                yield release
+
+            if error is not None:
+                logger.error(
+                    "Failed to process instance: %s (after %d releases)",
+                    name,
+                    count,
+                    exc_info=error,
+                )
+                if failed is not None:
+                    failed.append(name)
                 continue
 
-            code_gov_project = Project.from_ado(
-                project, labor_hours=compute_labor_hours
-            )
-            code_gov_metadata["releases"].append(code_gov_project)
+            logger.info("Processed instance: %s (%d releases)", name, count)
+    finally:
+        stopped.set()
+        if sys.is_finalizing():
+            # Abandoned at exit, its daemon threads are frozen (possibly
+            # holding locks needed below) and the process is exiting anyway
+            return
+        for _, releases, thread in threads:
+            # Labor hours still queued for releases that won't be consumed
+            while thread.is_alive() or not releases.empty():
+                try:
+                    item = releases.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item[0] is not _DONE and item[1] is not None:
+                    item[1].cancel()
+        run.close()
 
-    # Handle parsing of DOE CODE records
 
-    doecode_config = config.get("DOE CODE", {})
-    doecode_json = doecode_config.get("json", None)
-    doecode_url = doecode_config.get("url", None)
-    doecode_key = doecode_config.get("api_key", None)
+def process_config(config):
+    """
+    Master function to process a Scraper config file
 
-    for record in doecode.process(doecode_json, doecode_url, doecode_key):
-        code_gov_project = Project.from_doecode(record)
-        code_gov_metadata["releases"].append(code_gov_project)
+    Returns a Code.gov Metadata file
+    """
+    code_gov_metadata = create_metadata(config)
+    code_gov_metadata["releases"].extend(iter_releases(config))
 
     return code_gov_metadata
 
 
-def force_attributes(metadata, config):
+def force_release_attributes(releases, config):
     """
-    Forces certain fields in the Code.gov Metadata json
+    Forces certain fields in each of the given Code.gov releases
+
+    Yields the releases as they are updated, so this can be applied to a
+    stream of releases.
     """
 
     organization = config.get("organization", "")
@@ -187,7 +793,7 @@ def force_attributes(metadata, config):
     if contact_email:
         logger.debug("Forcing Contact Email to: %s", contact_email)
 
-    for release in metadata["releases"]:
+    for release in releases:
         if organization:
             release["organization"] = organization
 
@@ -204,4 +810,13 @@ def force_attributes(metadata, config):
             release["permissions"]["usageType"] = default_usage
             release["permissions"]["exemptionText"] = default_exemption_text
 
+        yield release
+
+
+def force_attributes(metadata, config):
+    """
+    Forces certain fields in the Code.gov Metadata json
+    """
+    metadata["releases"] = list(force_release_attributes(metadata["releases"], config))
+
     return metadata
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    An append-only log of completed Code.gov releases
+
+    Each line of the journal file is a JSON object holding the key of a
+    release and the release itself. Lines are flushed as they are written,
+    so every release completed before a crash survives it. Opening a journal
+    with ``resume=True`` loads the releases recorded by a previous run and
+    keeps appending to the same file.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.records = {}
+
+        if resume and os.path.exists(path):
+            self._load()
+            logger.info(
+                "Resuming from journal: %s (%d releases)", path, len(self.records)
+            )
+
+        self._lock = threading.Lock()
+        self._fp = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self):
+        """
+        Reads the journal file, dropping a partially written last line
+        """
+        valid_size = 0
+        with open(self.path, "rb") as fp:
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.records[entry["key"]] = entry["release"]
+                valid_size += len(line)
+
+        if valid_size != os.path.getsize(self.path):
+            logger.warning("Truncating incomplete journal entry: %s", self.path)
+            os.truncate(self.path, valid_size)
+
+    def get(self, key):
+        """
+        Returns the release recorded for ``key``, or None
+        """
+        return self.records.get(key)
+
+    def append(self, key, release):
+        """
+        Records a completed release
+        """
+        line = json.dumps({"key": key, "release": release}, ensure_ascii=False)
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
@@ -51,6 +51,46 @@ class Metadata(dict):
     def to_json(self):
         return json.dumps(self, indent=4, sort_keys=True, ensure_ascii=False)
 
+    def write_json(self, fp, releases=None):
+        """
+        Write the code.json document to ``fp``, one release at a time
+
+        The output is identical to ``fp.write(self.to_json())``, but each
+        release from ``releases`` (defaults to ``self["releases"]``) is
+        serialized and written as soon as it is produced, rather than
+        building the whole document as a single string first.
+
+        Returns the number of releases written.
+        """
+        if releases is None:
+            releases = self["releases"]
+
+        def _dumps(obj, level):
+            text = json.dumps(obj, indent=4, sort_keys=True, ensure_ascii=False)
+            return text.replace("\n", "\n" + " " * 4 * level)
+
+        count = 0
+        fp.write("{")
+        for index, key in enumerate(sorted(self)):
+            if index:
+                fp.write(",")
+            fp.write("\n    %s: " % json.dumps(key, ensure_ascii=False))
+
+            if key != "releases":
+                fp.write(_dumps(self[key], 1))
+                continue
+
+            fp.write("[")
+            for release in releases:
+                if count:
+                    fp.write(",")
+                fp.write("\n        " + _dumps(release, 2))
+                count += 1
+            fp.write("\n    ]" if count else "]")
+        fp.write("\n}")
+
+        return count
+
 
 class Project(dict):
     """
@@ -168,50 +208,100 @@ class Project(dict):
         # }
 
     @classmethod
-    def from_github3(klass, repository, labor_hours=True):
+    def from_github3(klass, repository, labor_hours=True, entity_cache=None):
         """
         Create CodeGovProject object from github3 Repository object
+
+        If an ``entity_cache`` (a scraper.cache.EntityCache) is given, owner
+        documents are looked up through it, so repositories sharing an owner
+        only fetch it once.
         """
         if not isinstance(repository, github3.repos.repo._Repository):
             raise TypeError("Repository must be a github3 Repository object")
 
         logger.info("Processing: %s", repository.full_name)
 
-        project = klass()
-
         logger.debug("GitHub3: repository=%s", repository)
 
-        # -- REQUIRED FIELDS --
+        repo_json = repository.as_dict()
+        if "license" in repo_json:
+            # Repository listings already include the detected license, which
+            # saves a request per repository
+            license_json = repo_json["license"]
+        else:
+            try:
+                repo_license = repository.license()
+            except github3.exceptions.NotFoundError:
+                logger.debug("no license found for repo=%s", repository)
+                repo_license = None
+            license_json = None
+            if repo_license and repo_license.license:
+                license_json = repo_license.license.as_dict()
+
+        # Pass the preview header per request rather than swapping it on the
+        # shared session, which is not safe when repos are processed in parallel
+        topics = repository._get(
+            repository.url + "/topics",
+            headers={"Accept": "application/vnd.github.mercy-preview+json"},
+        ).json()
 
-        project["name"] = repository.name
-        project["repositoryURL"] = repository.clone_url
-        project["description"] = repository.description
+        # Hacky way to get an Organization object back with GitHub3.py >= 1.2.0
+        owner_url = repository.owner.url
+
+        def fetch_owner():
+            owner_api_response = repository._get(owner_url)
+            owner_json = repository._json(owner_api_response, 200)
+            return {key: owner_json.get(key) for key in ("email", "html_url", "name")}
+
+        if entity_cache is None:
+            organization = fetch_owner()
+        else:
+            organization = entity_cache.get(owner_url, fetch_owner)
+
+        return klass.from_github_json(
+            repo_json,
+            repo_license=license_json,
+            topics=topics.get("names", []),
+            owner=organization,
+            languages=[lang for lang, _ in repository.languages()],
+            labor_hours=labor_hours,
+        )
+
+    @classmethod
+    def from_github_json(
+        klass, repository, repo_license, topics, owner, languages, labor_hours=True
+    ):
+        """
+        Create CodeGovProject object from GitHub REST API documents
 
-        try:
-            repo_license = repository.license()
-        except github3.exceptions.NotFoundError:
-            logger.debug("no license found for repo=%s", repository)
-            repo_license = None
+        ``repository`` is the repository document, ``repo_license`` the license
+        it was detected to have (or None), ``topics`` and ``languages`` lists
+        of names (languages by size) and ``owner`` holds the ``email``,
+        ``html_url`` and ``name`` of the owning organization or user.
+        """
+        project = klass()
+
+        # -- REQUIRED FIELDS --
+
+        project["name"] = repository["name"]
+        project["repositoryURL"] = repository["clone_url"]
+        project["description"] = repository["description"]
 
         if repo_license:
-            license_obj = repo_license.license
-            if license_obj:
-                logger.debug(
-                    "license spdx=%s; url=%s", license_obj.spdx_id, license_obj.url
-                )
-                if license_obj.url is None:
-                    project["permissions"]["licenses"] = [{"name": license_obj.spdx_id}]
-                else:
-                    project["permissions"]["licenses"] = [
-                        {"URL": license_obj.url, "name": license_obj.spdx_id}
-                    ]
+            logger.debug(
+                "license spdx=%s; url=%s", repo_license["spdx_id"], repo_license["url"]
+            )
+            if repo_license["url"] is None:
+                project["permissions"]["licenses"] = [{"name": repo_license["spdx_id"]}]
             else:
-                project["permissions"]["licenses"] = None
+                project["permissions"]["licenses"] = [
+                    {"URL": repo_license["url"], "name": repo_license["spdx_id"]}
+                ]
 
-        public_server = repository.html_url.startswith("https://github.com")
-        if not repository.private and public_server:
+        public_server = repository["html_url"].startswith("https://github.com")
+        if not repository["private"] and public_server:
             project["permissions"]["usageType"] = "openSource"
-        elif date_parse(repository.created_at) < POLICY_START_DATE:
+        elif date_parse(repository["created_at"]) < POLICY_START_DATE:
             project["permissions"]["usageType"] = "exemptByPolicyDate"
 
         if labor_hours:
@@ -220,37 +310,27 @@ class Project(dict):
             project["laborHours"] = 0
 
         project["tags"] = ["github"]
-        old_accept = repository.session.headers["Accept"]
-        repository.session.headers["Accept"] = (
-            "application/vnd.github.mercy-preview+json"
-        )
-        topics = repository._get(repository.url + "/topics").json()
-        project["tags"].extend(topics.get("names", []))
-        repository.session.headers["Accept"] = old_accept
+        project["tags"].extend(topics)
 
-        # Hacky way to get an Organization object back with GitHub3.py >= 1.2.0
-        owner_url = repository.owner.url
-        owner_api_response = repository._get(owner_url)
-        organization = repository._json(owner_api_response, 200)
-        project["contact"]["email"] = organization["email"]
-        project["contact"]["URL"] = organization["html_url"]
+        project["contact"]["email"] = owner["email"]
+        project["contact"]["URL"] = owner["html_url"]
 
         # -- OPTIONAL FIELDS --
 
         # project['version'] = ''
 
-        project["organization"] = organization["name"]
+        project["organization"] = owner["name"]
 
         # TODO: Currently, can't be an empty string, see: https://github.com/GSA/code-gov-web/issues/370
         project["status"] = "Development"
 
         project["vcs"] = "git"
 
-        project["homepageURL"] = repository.html_url
+        project["homepageURL"] = repository["html_url"]
 
-        project["downloadURL"] = repository.downloads_url
+        project["downloadURL"] = repository["downloads_url"]
 
-        project["languages"] = [lang for lang, _ in repository.languages()]
+        project["languages"] = list(languages)
 
         # project['partners'] = []
 
@@ -262,18 +342,102 @@ class Project(dict):
         #   created: [string] The date the release was originally created, in YYYY-MM-DD or ISO 8601 format.
         #   lastModified: [string] The date the release was modified, in YYYY-MM-DD or ISO 8601 format.
         #   metadataLastUpdated: [string] The date the metadata of the release was last updated, in YYYY-MM-DD or ISO 8601 format.
-        try:
-            created_at = repository.created_at.date()
-        except AttributeError:
-            created_at = date_parse(repository.created_at).date()
-        try:
-            updated_at = repository.updated_at.date()
-        except AttributeError:
-            updated_at = date_parse(repository.updated_at).date()
+        project["date"] = {
+            "created": date_parse(repository["created_at"]).date().isoformat(),
+            "lastModified": date_parse(repository["updated_at"]).date().isoformat(),
+            "metadataLastUpdated": "",
+        }
+
+        _prune_dict_null_str(project)
+
+        return project
+
+    @classmethod
+    def from_github_graphql(
+        klass, repository, labor_hours=True, api_url="https://api.github.com"
+    ):
+        """
+        Create CodeGovProject object from a GitHub GraphQL repository dict
+
+        The dict must hold the fields queried by
+        scraper.github.query_repos_graphql, so that no further API requests
+        are needed. ``api_url`` is the REST API root of the server, used to
+        build the same license and download URLs as from_github3.
+        """
+        if not isinstance(repository, dict):
+            raise TypeError("Repository must be a GitHub GraphQL repository dict")
+
+        logger.info("Processing: %s", repository["nameWithOwner"])
+
+        project = klass()
+
+        logger.debug("GitHub GraphQL: repository=%s", repository)
+
+        # -- REQUIRED FIELDS --
+
+        project["name"] = repository["name"]
+        project["repositoryURL"] = repository["url"] + ".git"
+        project["description"] = repository["description"]
+
+        license_info = repository["licenseInfo"]
+        if license_info:
+            logger.debug(
+                "license spdx=%s; key=%s", license_info["spdxId"], license_info["key"]
+            )
+            # GitHub has no license document for licenses it can't identify
+            if license_info["key"] == "other":
+                project["permissions"]["licenses"] = [{"name": license_info["spdxId"]}]
+            else:
+                project["permissions"]["licenses"] = [
+                    {
+                        "URL": "%s/licenses/%s" % (api_url, license_info["key"]),
+                        "name": license_info["spdxId"],
+                    }
+                ]
+
+        public_server = repository["url"].startswith("https://github.com")
+        if not repository["isPrivate"] and public_server:
+            project["permissions"]["usageType"] = "openSource"
+        elif date_parse(repository["createdAt"]) < POLICY_START_DATE:
+            project["permissions"]["usageType"] = "exemptByPolicyDate"
+
+        if labor_hours:
+            project["laborHours"] = labor_hours_from_url(project["repositoryURL"])
+        else:
+            project["laborHours"] = 0
+
+        project["tags"] = ["github"]
+        project["tags"].extend(
+            node["topic"]["name"] for node in repository["repositoryTopics"]["nodes"]
+        )
+
+        owner = repository["owner"]
+        project["contact"]["email"] = owner.get("email")
+        project["contact"]["URL"] = owner["url"]
+
+        # -- OPTIONAL FIELDS --
+
+        project["organization"] = owner.get("name")
+
+        # TODO: Currently, can't be an empty string, see: https://github.com/GSA/code-gov-web/issues/370
+        project["status"] = "Development"
+
+        project["vcs"] = "git"
+
+        project["homepageURL"] = repository["url"]
+
+        project["downloadURL"] = "%s/repos/%s/downloads" % (
+            api_url,
+            repository["nameWithOwner"],
+        )
+
+        project["languages"] = [
+            node["name"] for node in repository["languages"]["nodes"]
+        ]
 
         project["date"] = {
-            "created": created_at.isoformat(),
-            "lastModified": updated_at.isoformat(),
+            "created": date_parse(repository["createdAt"]).date().isoformat(),
+            "lastModified": date_parse(repository["updatedAt"]).date().isoformat(),
             "metadataLastUpdated": "",
         }
 
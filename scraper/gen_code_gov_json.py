@@ -2,9 +2,11 @@
 # -*- coding: UTF-8 -*-
 
 import argparse
+import contextlib
 import json
 import logging
 import os
+import sys
 
 from scraper import code_gov
 from scraper.util import configure_logging
@@ -49,7 +51,7 @@ def main():
     parser.add_argument(
         "--github-gov-orgs",
         action="store_true",
-        help="Use orgs from government.github.com/community",
+        help="Use orgs from government.github.com/community (a copy is kept in --cache)",
     )
     parser.add_argument(
         "--skip-labor-hours",
@@ -57,6 +59,32 @@ def main():
         help='Skip calculation of labor hours, assume "0"',
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of repositories to process concurrently per instance",
+    )
+
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Path to a cache file, used to reuse unchanged results across runs",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run from the journal next to the output file",
+    )
+    parser.add_argument(
+        "--allow-partial",
+        action="store_true",
+        help="Replace the output file even if some instances failed",
+    )
+
     parser.add_argument(
         "--doecode-json",
         type=str,
@@ -123,6 +151,10 @@ def main():
         config_json["compute_labor_hours"] = False
     if args.github_gov_orgs:
         config_json["github_gov_orgs"] = True
+    if args.jobs is not None:
+        config_json["jobs"] = args.jobs
+    if args.cache:
+        config_json["cache_path"] = args.cache
 
     config_json["DOE CODE"] = {}
     config_json["DOE CODE"]["json"] = args.doecode_json
@@ -138,20 +170,57 @@ def main():
             "Invalid output path argument provided!  Make sure the output path exists and try again."
         )
 
-    code_json = code_gov.process_config(config_json)
-
-    code_gov.force_attributes(code_json, config_json)
-
-    logger.info("Number of Projects: %s", len(code_json["releases"]))
-
     output_filepath = args.output_filename
 
     if output_path is not None:
         output_filepath = os.path.join(output_path, output_filepath)
 
-    with open(output_filepath, "w", encoding="utf-8") as fp:
-        logger.info("Writing output to: %s", output_filepath)
-        fp.write(code_json.to_json())
+    # Completed releases are journaled as they are produced, so that an
+    # interrupted run can be picked up again with --resume
+    journal_path = output_filepath + ".journal"
+    config_json["journal_path"] = journal_path
+    config_json["resume"] = args.resume
+
+    code_json = code_gov.create_metadata(config_json)
+    failed = []
+    stream = code_gov.iter_releases(config_json, failed)
+    releases = code_gov.force_release_attributes(stream, config_json)
+
+    # Releases are streamed to a temporary file next to the output, which
+    # replaces the output only once the whole document has been written
+    tmp_filepath = output_filepath + ".tmp"
+    try:
+        # Closed explicitly, so that a failed write stops the instance
+        # tasks right away, rather than whenever the stream is collected
+        with contextlib.closing(stream), open(
+            tmp_filepath, "w", encoding="utf-8"
+        ) as fp:
+            logger.info("Writing output to: %s", output_filepath)
+            num_releases = code_json.write_json(fp, releases)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+
+    logger.info("Number of Projects: %s", num_releases)
+
+    if not failed:
+        os.replace(tmp_filepath, output_filepath)
+        os.remove(journal_path)
+        return
+
+    # An incomplete inventory (including any releases of the failed instances
+    # produced before they failed) is only published if asked for
+    if args.allow_partial:
+        os.replace(tmp_filepath, output_filepath)
+    else:
+        partial_filepath = output_filepath + ".partial"
+        os.replace(tmp_filepath, partial_filepath)
+        logger.error("Left %s unchanged, wrote %s", output_filepath, partial_filepath)
+    logger.error(
+        "Incomplete inventory, failed instances: %s. Fix and rerun with --resume",
+        ", ".join(failed),
+    )
+    sys.exit(1)
 
 
 if __name__ == "__main__":
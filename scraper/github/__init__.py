@@ -1,33 +1,60 @@
 #! /usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import functools
 import logging
 import os
-import time
 
 import github3
 import requests
 
-from scraper.util import DEFAULT_REQUESTS_TIMEOUTS
+from scraper.cache import ConditionalCacheAdapter
+from scraper.github.ratelimit import RateLimitTracker, ThrottledSession
+from scraper.github.tokens import TokenPool
+from scraper.util import DEFAULT_REQUESTS_TIMEOUTS, ordered_map
 
 logger = logging.getLogger(__name__)
 
+_GOV_ORGS_URL = "https://government.github.com/organizations.json"
 
-def gov_orgs():
+
+def gov_orgs(cache=None, ttl=None):
     """
     Returns a list of the names of US Government GitHub organizations
 
     Based on: https://government.github.com/community/
 
+    If a ``cache`` (a scraper.cache.DiskCache) is given, the list is reused
+    for ``ttl`` seconds. When the list can't be fetched, the last copy in
+    the cache is used regardless of its age. Without a cache there is no
+    copy to fall back on, and the error is raised.
+
     Example return:
         {'llnl', '18f', 'gsa', 'dhs-ncats', 'spack', ...}
     """
+    if cache is not None:
+        cached = cache.get(_GOV_ORGS_URL, max_age=ttl)
+        if cached is not None:
+            logger.debug("Using cached government organizations")
+            return cached
+
     us_gov_github_orgs = set()
 
-    gov_orgs_json = requests.get(
-        "https://government.github.com/organizations.json",
-        timeout=DEFAULT_REQUESTS_TIMEOUTS,
-    ).json()
+    try:
+        gov_orgs_json = requests.get(
+            _GOV_ORGS_URL,
+            timeout=DEFAULT_REQUESTS_TIMEOUTS,
+        ).json()
+    except (requests.exceptions.RequestException, ValueError):
+        snapshot = cache and cache.get(_GOV_ORGS_URL)
+        if snapshot is None:
+            logger.error(
+                "Unable to fetch %s, and no copy of it is cached (see cache_path)",
+                _GOV_ORGS_URL,
+            )
+            raise
+        logger.warning("Unable to fetch %s, using the last cached copy", _GOV_ORGS_URL)
+        return snapshot
 
     us_gov_github_orgs.update(gov_orgs_json["governments"]["U.S. Federal"])
     us_gov_github_orgs.update(
@@ -35,15 +62,43 @@ def gov_orgs():
     )
     us_gov_github_orgs.update(gov_orgs_json["research"]["U.S. Research Labs"])
 
-    return list(us_gov_github_orgs)
+    us_gov_github_orgs = sorted(us_gov_github_orgs)
+    if cache is not None:
+        cache.set(_GOV_ORGS_URL, us_gov_github_orgs)
+
+    return us_gov_github_orgs
+
+
+def _token_pool(token):
+    """
+    Returns a TokenPool if ``token`` is a list of tokens, otherwise None
+    """
+    if isinstance(token, (list, tuple)):
+        return TokenPool(token)
+    return None
+
+
+def _mount_http_cache(custom_session, http_cache):
+    """
+    Revalidates the GET requests of a session against a ConditionalCache
+    """
+    if http_cache is not None:
+        adapter = ConditionalCacheAdapter(http_cache)
+        custom_session.mount("https://", adapter)
+        custom_session.mount("http://", adapter)
 
 
-def create_session(token=None, timeouts=None):
+def create_session(token=None, timeouts=None, http_cache=None):
     """
     Create a github3.py session connected to GitHub.com
 
     If token is not provided, will attempt to use the GITHUB_API_TOKEN
-    environment variable if present.
+    environment variable if present. If token is a list of tokens, each
+    request uses the one with the most rate limit budget left.
+
+    If an ``http_cache`` (a scraper.cache.ConditionalCache) is provided,
+    unchanged documents are revalidated with conditional requests instead
+    of being downloaded again.
     """
     if token is None:
         token = os.environ.get("GITHUB_API_TOKEN", None)
@@ -51,32 +106,51 @@ def create_session(token=None, timeouts=None):
     if timeouts is None:
         timeouts = {}
 
-    custom_session = github3.session.GitHubSession(**timeouts)
+    token_pool = _token_pool(token)
+    if token_pool is not None:
+        token = None
+
+    custom_session = ThrottledSession(**timeouts)
+    _mount_http_cache(custom_session, http_cache)
+    _rate_limit_tracker(custom_session)
     gh_session = github3.GitHub(token=token, session=custom_session)
 
     if gh_session is None:
         raise RuntimeError("Invalid or missing GITHUB_API_TOKEN")
 
+    if token_pool is not None:
+        custom_session.auth = token_pool
+
     return gh_session
 
 
-def create_enterprise_session(url, token=None, timeouts=None):
+def create_enterprise_session(url, token=None, timeouts=None, http_cache=None):
     """
     Create a github3.py session for a GitHub Enterprise instance
 
     If token is not provided, will attempt to use the GITHUB_API_TOKEN
-    environment variable if present.
+    environment variable if present. If token is a list of tokens, each
+    request uses the one with the most rate limit budget left.
     """
     if timeouts is None:
         timeouts = {}
 
-    custom_session = github3.session.GitHubSession(**timeouts)
+    token_pool = _token_pool(token)
+    if token_pool is not None:
+        token = None
+
+    custom_session = ThrottledSession(**timeouts)
+    _mount_http_cache(custom_session, http_cache)
+    _rate_limit_tracker(custom_session)
     gh_session = github3.GitHubEnterprise(url=url, token=token, session=custom_session)
 
     if gh_session is None:
         msg = "Unable to connect to GitHub Enterprise (%s) with provided token."
         raise RuntimeError(msg, url)
 
+    if token_pool is not None:
+        custom_session.auth = token_pool
+
     return gh_session
 
 
@@ -87,35 +161,40 @@ def _num_requests_needed(num_repos, factor=2, wiggle_room=100):
     return num_repos * factor + wiggle_room
 
 
-def _check_api_limits(gh_session, api_required=250):
+def _rate_limit_tracker(custom_session):
     """
-    Simplified check for API limits
+    Returns the RateLimitTracker of a session, installing one if needed
+    """
+    tracker = getattr(custom_session, "rate_limit_tracker", None)
+    if tracker is None:
+        tracker = RateLimitTracker()
+        custom_session.hooks["response"].append(tracker.update)
+        custom_session.rate_limit_tracker = tracker
+    return tracker
 
-    If necessary, spin in place waiting for API to reset before returning.
 
-    See: https://developer.github.com/v3/#rate-limiting
+def _check_api_limits(gh_session, api_required=250, resource="core"):
     """
-    api_rates = gh_session.rate_limit()
+    Simplified check for API limits
 
-    api_remaining = api_rates["rate"]["remaining"]
-    api_reset = api_rates["rate"]["reset"]
-    logger.debug("Rate Limit - %d requests remaining", api_remaining)
+    If necessary, sleep until the API resets before returning. The budget
+    is read from the headers of the responses already received, so this
+    only makes a request of its own the first time a resource is checked.
 
-    if api_remaining > api_required:
+    See: https://developer.github.com/v3/#rate-limiting
+    """
+    if isinstance(gh_session.session.auth, TokenPool):
+        # The pool tracks every token and only waits once they are all spent
         return
 
-    now_time = time.time()
-    time_to_reset = int(api_reset - now_time)
-    logger.warning("Rate Limit Depleted - Sleeping for %d seconds", time_to_reset)
+    tracker = _rate_limit_tracker(gh_session.session)
+    if tracker.budget(resource) is None:
+        tracker.seed(gh_session.rate_limit())
 
-    while now_time < api_reset:
-        time.sleep(10)
-        now_time = time.time()
+    tracker.wait(api_required, resource)
 
-    return
 
-
-def connect(url="https://github.com", token=None, timeouts=None):
+def connect(url="https://github.com", token=None, timeouts=None, http_cache=None):
     """
     Create a GitHub session for making requests
     """
@@ -125,9 +204,9 @@ def connect(url="https://github.com", token=None, timeouts=None):
 
     gh_session = None
     if url == "https://github.com":
-        gh_session = create_session(token, timeouts)
+        gh_session = create_session(token, timeouts, http_cache)
     else:
-        gh_session = create_enterprise_session(url, token, timeouts)
+        gh_session = create_enterprise_session(url, token, timeouts, http_cache)
 
     if gh_session is None:
         msg = "Unable to connect to (%s) with provided token."
@@ -138,7 +217,38 @@ def connect(url="https://github.com", token=None, timeouts=None):
     return gh_session
 
 
-def query_repos(gh_session, orgs=None, repos=None, public_only=True):
+def _org_repos(gh_session, privacy, org_name):
+    """
+    Yields GitHub3.py repo objects for an organization
+    """
+    org = gh_session.organization(org_name)
+    num_repos = org.public_repos_count
+
+    _check_api_limits(gh_session, _num_requests_needed(num_repos))
+
+    for repo in org.repositories(type=privacy):
+        _check_api_limits(gh_session, 10)
+        yield repo
+
+
+def _each_org(org_repos, orgs, jobs):
+    """
+    Yields the repos of every organization, listing up to ``jobs`` at once
+    """
+    if jobs > 1:
+        # Organizations are listed whole on the pool but yielded in order
+        for repos in ordered_map(
+            lambda org_name: list(org_repos(org_name)), orgs, jobs
+        ):
+            yield from repos
+    else:
+        for org_name in orgs:
+            yield from org_repos(org_name)
+
+
+def query_repos(
+    gh_session, orgs=None, repos=None, public_only=True, jobs=1, crawl=None
+):
     """
     Yields GitHub3.py repo objects for provided orgs and repo names
 
@@ -148,6 +258,11 @@ def query_repos(gh_session, orgs=None, repos=None, public_only=True):
     If public_only is True, will return only those repos that are marked as
     public. Set this to false to return all organizations that the session has
     permissions to access.
+
+    With ``jobs`` > 1, that many orgs are listed concurrently.
+
+    If a ``crawl`` (a scraper.github.crawl.RepositoryCrawl) is given, it is
+    used to list ALL repositories instead of a single serial listing.
     """
 
     if orgs is None:
@@ -161,15 +276,7 @@ def query_repos(gh_session, orgs=None, repos=None, public_only=True):
 
     _check_api_limits(gh_session, 10)
 
-    for org_name in orgs:
-        org = gh_session.organization(org_name)
-        num_repos = org.public_repos_count
-
-        _check_api_limits(gh_session, _num_requests_needed(num_repos))
-
-        for repo in org.repositories(type=privacy):
-            _check_api_limits(gh_session, 10)
-            yield repo
+    yield from _each_org(functools.partial(_org_repos, gh_session, privacy), orgs, jobs)
 
     for repo_name in repos:
         _check_api_limits(gh_session, 10)
@@ -177,5 +284,311 @@ def query_repos(gh_session, orgs=None, repos=None, public_only=True):
         yield gh_session.repository(org, name)
 
     if not (orgs or repos):
-        for repo in gh_session.all_repositories():
+        if crawl is not None:
+            yield from crawl.repositories()
+        else:
+            for repo in gh_session.all_repositories():
+                yield repo
+
+
+# Fields needed by Project.from_github_graphql for each repository
+_REPOSITORY_FIELDS = """
+fragment RepositoryFields on Repository {
+  id
+  databaseId
+  name
+  nameWithOwner
+  description
+  url
+  isPrivate
+  createdAt
+  updatedAt
+  pushedAt
+  diskUsage
+  licenseInfo { key spdxId }
+  repositoryTopics(first: 100) { nodes { topic { name } } }
+  owner {
+    login
+    url
+    ... on Organization { email name }
+    ... on User { email name }
+  }
+  languages(first: 100, orderBy: {field: SIZE, direction: DESC}) {
+    nodes { name }
+  }
+}
+"""
+
+_ORG_REPOSITORIES_QUERY = """
+query ($org: String!, $privacy: RepositoryPrivacy, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: 100, after: $cursor, privacy: $privacy) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...RepositoryFields }
+    }
+  }
+}
+""" + _REPOSITORY_FIELDS
+
+
+_ORG_REPOSITORY_IDS_QUERY = """
+query ($org: String!, $privacy: RepositoryPrivacy, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: 100, after: $cursor, privacy: $privacy) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id }
+    }
+  }
+}
+"""
+
+# The repository count and newest repository of an organization, which
+# change whenever a repository is added or removed
+_ORG_REPOSITORIES_PROBE_QUERY = """
+query ($org: String!, $privacy: RepositoryPrivacy) {
+  organization(login: $org) {
+    repositories(
+      first: 1, privacy: $privacy, orderBy: {field: CREATED_AT, direction: DESC}
+    ) {
+      totalCount
+      nodes { id }
+    }
+  }
+}
+"""
+
+_NODES_QUERY = """
+query ($ids: [ID!]!) {
+  nodes(ids: $ids) { ...RepositoryFields }
+}
+""" + _REPOSITORY_FIELDS
+
+
+def graphql_url(gh_session):
+    """
+    Returns the GraphQL endpoint of the server a github3.py session targets
+    """
+    base_url = gh_session.session.base_url
+    if base_url.endswith("/api/v3"):
+        # GitHub Enterprise serves GraphQL from /api/graphql
+        return base_url.rsplit("/", 1)[0] + "/graphql"
+    return base_url + "/graphql"
+
+
+def query_graphql(gh_session, query, variables=None, ignored_errors=()):
+    """
+    Executes a GraphQL query with a github3.py session and returns its data
+
+    Errors whose type is listed in ``ignored_errors`` (e.g. "NOT_FOUND") are
+    only logged, the affected fields are then null in the data.
+
+    See: https://docs.github.com/en/graphql
+    """
+    response = gh_session.session.post(
+        graphql_url(gh_session), json={"query": query, "variables": variables or {}}
+    )
+    response.raise_for_status()
+    result = response.json()
+
+    errors = []
+    for error in result.get("errors", []):
+        if error.get("type") in ignored_errors:
+            logger.debug("GraphQL error ignored: %s", error["message"])
+        else:
+            errors.append(error)
+
+    if errors:
+        messages = "; ".join(error["message"] for error in errors)
+        raise RuntimeError("GraphQL query failed: %s" % messages)
+
+    return result["data"]
+
+
+def _paginate_org_repos(gh_session, query, privacy, org_name):
+    """
+    Yields the repository nodes of an organization listing query
+    """
+    cursor = None
+    while True:
+        _check_api_limits(gh_session, 10, resource="graphql")
+        data = query_graphql(
+            gh_session, query, {"org": org_name, "privacy": privacy, "cursor": cursor}
+        )
+        repositories = data["organization"]["repositories"]
+        yield from repositories["nodes"]
+
+        if not repositories["pageInfo"]["hasNextPage"]:
+            break
+        cursor = repositories["pageInfo"]["endCursor"]
+
+
+def _repos_by_ids(gh_session, ids):
+    """
+    Yields GraphQL repository dicts for node ids, 100 per request
+
+    Repositories that no longer exist are yielded as None.
+    """
+    pending = list(ids)
+    while pending:
+        batch, pending = pending[:100], pending[100:]
+        _check_api_limits(gh_session, 10, resource="graphql")
+        data = query_graphql(
+            gh_session, _NODES_QUERY, {"ids": batch}, ignored_errors=("NOT_FOUND",)
+        )
+        yield from data["nodes"]
+
+
+def _org_repo_ids(gh_session, privacy, org_name, node_cache, ttl):
+    """
+    Returns the node ids of an organization's repositories
+
+    Ids recorded in the ``node_cache`` less than ``ttl`` seconds ago are
+    reused as long as the organization's repository count and newest
+    repository match them. Otherwise they are listed again, which is much
+    cheaper than listing the repositories themselves.
+    """
+    key = "%s:%s:%s" % (graphql_url(gh_session), org_name, privacy)
+    known = node_cache.get(key, max_age=ttl)
+
+    if known is not None:
+        _check_api_limits(gh_session, 10, resource="graphql")
+        data = query_graphql(
+            gh_session,
+            _ORG_REPOSITORIES_PROBE_QUERY,
+            {"org": org_name, "privacy": privacy},
+        )
+        repositories = data["organization"]["repositories"]
+        newest = [node["id"] for node in repositories["nodes"]]
+        if repositories["totalCount"] == len(known) and set(newest) <= set(known):
+            logger.debug("Refreshing %d known repositories: %s", len(known), org_name)
+            return known
+
+    ids = [
+        node["id"]
+        for node in _paginate_org_repos(
+            gh_session, _ORG_REPOSITORY_IDS_QUERY, privacy, org_name
+        )
+    ]
+    if known is not None:
+        logger.info(
+            "Repositories changed: %s (%d added, %d removed)",
+            org_name,
+            len(set(ids) - set(known)),
+            len(set(known) - set(ids)),
+        )
+    node_cache.set(key, ids)
+
+    return ids
+
+
+def _org_repos_graphql(gh_session, privacy, org_name, node_cache=None, ttl=None):
+    """
+    Yields GraphQL repository dicts for an organization
+
+    With a ``node_cache``, the repositories are refreshed by node id rather
+    than listed (see _org_repo_ids).
+    """
+    if node_cache is None:
+        yield from _paginate_org_repos(
+            gh_session, _ORG_REPOSITORIES_QUERY, privacy, org_name
+        )
+        return
+
+    ids = _org_repo_ids(gh_session, privacy, org_name, node_cache, ttl)
+    for repo in _repos_by_ids(gh_session, ids):
+        if repo is not None:
             yield repo
+
+
+def _repos_by_names(gh_session, repo_names):
+    """
+    Yields (name, GraphQL repository dict) for "owner/name" repository names
+    """
+    params = []
+    fields = []
+    variables = {}
+    for index, repo_name in enumerate(repo_names):
+        owner, name = repo_name.split("/")
+        params.append("$owner%d: String!, $name%d: String!" % (index, index))
+        fields.append(
+            "repo%d: repository(owner: $owner%d, name: $name%d) "
+            "{ ...RepositoryFields }" % (index, index, index)
+        )
+        variables["owner%d" % index] = owner
+        variables["name%d" % index] = name
+
+    query = "query (%s) {\n%s\n}\n" % (", ".join(params), "\n".join(fields))
+
+    _check_api_limits(gh_session, 10, resource="graphql")
+    data = query_graphql(gh_session, query + _REPOSITORY_FIELDS, variables)
+    for index, repo_name in enumerate(repo_names):
+        yield repo_name, data["repo%d" % index]
+
+
+def query_repos_graphql(
+    gh_session,
+    orgs=None,
+    repos=None,
+    public_only=True,
+    jobs=1,
+    node_cache=None,
+    ttl=None,
+):
+    """
+    Yields GraphQL repository dicts for provided orgs and repo names
+
+    Unlike query_repos, repositories are fetched along with everything
+    Project.from_github_graphql needs, 100 at a time, so enriching them
+    takes no further API requests.
+
+    With ``jobs`` > 1, that many orgs are listed concurrently.
+
+    If a ``node_cache`` (a scraper.cache.DiskCache) is given, the node ids
+    of the repositories are kept in it, and known repositories are fetched
+    by id with ``nodes(ids: ...)``. Org listings are then only repeated to
+    find added or removed repositories, at most every ``ttl`` seconds.
+    """
+    if orgs is None:
+        orgs = []
+    if repos is None:
+        repos = []
+    if not (orgs or repos):
+        raise ValueError("GraphQL queries need orgs or repos to be listed")
+
+    privacy = "PUBLIC" if public_only else None
+
+    yield from _each_org(
+        functools.partial(
+            _org_repos_graphql, gh_session, privacy, node_cache=node_cache, ttl=ttl
+        ),
+        orgs,
+        jobs,
+    )
+
+    known = {}
+    fetched = {}
+    if node_cache is not None:
+        # Repositories that were found before are fetched by node id, and
+        # looked up by name again if that fails (e.g. they were deleted)
+        key = "%s:repos" % graphql_url(gh_session)
+        known = node_cache.get(key, default={})
+        names = [repo_name for repo_name in repos if repo_name in known]
+        refreshed = _repos_by_ids(gh_session, [known[name] for name in names])
+        for repo_name, repo in zip(names, refreshed):
+            if repo is not None:
+                fetched[repo_name] = repo
+
+    # Repositories are yielded in the order they are configured in, looking
+    # up the rest by name 100 at a time as they are reached
+    pending = [repo_name for repo_name in repos if repo_name not in fetched]
+    found = dict(known)
+    for repo_name in repos:
+        if repo_name not in fetched:
+            batch, pending = pending[:100], pending[100:]
+            for name, repo in _repos_by_names(gh_session, batch):
+                found[name] = repo["id"]
+                fetched[name] = repo
+        yield fetched[repo_name]
+
+    if node_cache is not None and found != known:
+        node_cache.set(key, found)
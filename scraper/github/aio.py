@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+An asyncio backend for listing and enriching GitHub repositories
+
+Rather than spreading blocking github3.py calls over threads, every request
+is made from a single event loop through a pooled aiohttp client, so that
+hundreds of requests can be in flight at once. The documents it gathers for
+each repository are the ones Project.from_github_json is built from.
+
+Requires the optional ``aiohttp`` dependency: pip install llnl-scraper[async]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from scraper.github.ratelimit import RateLimitTracker, secondary_limit_wait
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items handed from the event loop to the caller
+_DONE = object()
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError as error:
+        raise ImportError(
+            "The async GitHub backend requires aiohttp: "
+            "pip install llnl-scraper[async]"
+        ) from error
+    return aiohttp
+
+
+class AsyncGitHub:
+    """
+    A minimal asyncio client for the GitHub REST API
+
+    At most ``max_in_flight`` requests are made at once. Requests wait when
+    the primary rate limit is spent, and are retried after a secondary rate
+    limit response.
+    """
+
+    def __init__(
+        self,
+        url="https://github.com",
+        token=None,
+        max_in_flight=100,
+        timeouts=None,
+        max_retries=5,
+    ):
+        if token is None:
+            token = os.environ.get("GITHUB_API_TOKEN", None)
+        if timeouts is None:
+            timeouts = {}
+
+        if url == "https://github.com":
+            self.api_url = "https://api.github.com"
+        else:
+            self.api_url = url.rstrip("/") + "/api/v3"
+
+        self.token = token
+        self.max_in_flight = max_in_flight
+        self.timeouts = timeouts
+        self.max_retries = max_retries
+        self.rate_limits = RateLimitTracker()
+
+        self._session = None
+        self._semaphore = None
+        self._owners = {}
+
+    async def __aenter__(self):
+        aiohttp = _aiohttp()
+
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = "token %s" % self.token
+
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.timeouts.get("default_connect_timeout", 4),
+                sock_read=self.timeouts.get("default_read_timeout", 10),
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def _wait_for_budget(self):
+        budget = self.rate_limits.budget("core")
+        if budget is None:
+            return
+
+        remaining, reset = budget
+        if remaining > 0 or reset is None:
+            return
+
+        time_to_reset = max(reset - time.time(), 0) + 1
+        logger.warning("Rate Limit Depleted - Sleeping for %d seconds", time_to_reset)
+        await asyncio.sleep(time_to_reset)
+
+    async def get(self, url, params=None, headers=None):
+        """
+        Returns the decoded JSON of a GET request and its Link header URLs
+
+        Returns None as the JSON if the document does not exist.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_budget()
+
+            async with self._semaphore:
+                async with self._session.get(
+                    url, params=params, headers=headers
+                ) as response:
+                    body = await response.read()
+
+            self.rate_limits.update(response)
+
+            wait = None
+            if response.status in (403, 429):
+                wait = secondary_limit_wait(
+                    response.status, response.headers, body.decode("utf-8", "replace")
+                )
+            if wait is None or attempt == self.max_retries:
+                break
+            logger.warning("Secondary Rate Limit - Sleeping for %d seconds", wait)
+            await asyncio.sleep(wait)
+
+        if response.status == 404:
+            return None, {}
+        response.raise_for_status()
+
+        links = {str(rel): str(link["url"]) for rel, link in response.links.items()}
+        return json.loads(body), links
+
+    async def paginate(self, url, params=None):
+        """
+        Yields the items of every page of a listing
+        """
+        params = dict(params or {}, per_page=100)
+        while url:
+            items, links = await self.get(url, params)
+            for item in items or []:
+                yield item
+            # The next link already holds the query parameters
+            url, params = links.get("next"), None
+
+    async def repositories(self, orgs=None, repos=None, public_only=True):
+        """
+        Yields repository documents for provided orgs and repo names
+
+        If orgs and repos are BOTH empty, yields ALL repositories from the
+        GitHub Server, as github.query_repos does.
+        """
+        orgs = orgs or []
+        repos = repos or []
+        privacy = "public" if public_only else "all"
+
+        for org_name in orgs:
+            url = "%s/orgs/%s/repos" % (self.api_url, org_name)
+            async for repo in self.paginate(url, {"type": privacy}):
+                yield repo
+
+        # Explicit repositories are all requested at once
+        lookups = [
+            asyncio.ensure_future(self.get("%s/repos/%s" % (self.api_url, repo_name)))
+            for repo_name in repos
+        ]
+        for repo_name, lookup in zip(repos, lookups):
+            repo, _ = await lookup
+            if repo is None:
+                raise LookupError("Repository not found: %s" % repo_name)
+            yield repo
+
+        if not (orgs or repos):
+            async for repo in self.paginate("%s/repositories" % self.api_url):
+                yield repo
+
+    async def _owner(self, url):
+        # Repositories sharing an owner share a single request for it
+        if url not in self._owners:
+            self._owners[url] = asyncio.ensure_future(self.get(url))
+        owner, _ = await self._owners[url]
+        if owner is None:
+            raise LookupError("Owner not found: %s" % url)
+        return {key: owner.get(key) for key in ("email", "html_url", "name")}
+
+    async def _license(self, repository):
+        if "license" in repository:
+            return repository["license"]
+        repo_license, _ = await self.get(repository["url"] + "/license")
+        return repo_license and repo_license["license"]
+
+    async def _topics(self, repository):
+        topics, _ = await self.get(
+            repository["url"] + "/topics",
+            headers={"Accept": "application/vnd.github.mercy-preview+json"},
+        )
+        return (topics or {}).get("names", [])
+
+    async def _languages(self, repository):
+        languages, _ = await self.get(repository["languages_url"])
+        return list(languages or {})
+
+    async def documents(self, repository):
+        """
+        Returns the keyword arguments of Project.from_github_json
+        """
+        repo_license, topics, owner, languages = await asyncio.gather(
+            self._license(repository),
+            self._topics(repository),
+            self._owner(repository["owner"]["url"]),
+            self._languages(repository),
+        )
+        return {
+            "repo_license": repo_license,
+            "topics": topics,
+            "owner": owner,
+            "languages": languages,
+        }
+
+
+def iter_documents(
+    url="https://github.com",
+    token=None,
+    orgs=None,
+    repos=None,
+    public_only=True,
+    prepare=None,
+    max_in_flight=100,
+    timeouts=None,
+):
+    """
+    Yields (repository, state, documents) for every repository, in order
+
+    The repositories are listed and enriched on an event loop running in a
+    background thread, and handed over to the caller as they complete.
+
+    ``prepare(repository)`` is called in a worker thread as each repository
+    is listed, and returns a ``(fetch, state)`` pair: ``state`` is passed through to the
+    caller, and the documents of the repository are only fetched if
+    ``fetch`` is true (otherwise documents is None). Up to ``max_in_flight``
+    repositories are enriched at once.
+    """
+    if prepare is None:
+
+        def prepare(repository):
+            return True, None
+
+    results = queue.Queue(maxsize=max_in_flight)
+    stopped = threading.Event()
+
+    async def produce():
+        async with AsyncGitHub(url, token, max_in_flight, timeouts) as client:
+            pending = asyncio.Queue(maxsize=max_in_flight)
+            fetching = set()
+
+            async def list_repositories():
+                try:
+                    async for repository in client.repositories(
+                        orgs, repos, public_only
+                    ):
+                        # It may block (e.g. on a cache lookup)
+                        fetch, state = await loop.run_in_executor(
+                            None, prepare, repository
+                        )
+                        documents = None
+                        if fetch:
+                            documents = asyncio.ensure_future(
+                                client.documents(repository)
+                            )
+                            fetching.add(documents)
+                            documents.add_done_callback(fetching.discard)
+                        await pending.put((repository, state, documents))
+                except Exception as error:  # Raised by the consumer below
+                    await pending.put(error)
+                else:
+                    await pending.put(_DONE)
+
+            loop = asyncio.get_running_loop()
+            lister = asyncio.ensure_future(list_repositories())
+            try:
+                # Hands over the repositories in listing order
+                while not stopped.is_set():
+                    item = await pending.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    repository, state, documents = item
+                    if documents is not None:
+                        documents = await documents
+                    await loop.run_in_executor(
+                        None, results.put, (repository, state, documents)
+                    )
+            finally:
+                lister.cancel()
+                # Nobody is left to wait for them if the caller stopped early
+                for documents in list(fetching):
+                    documents.cancel()
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except BaseException as error:  # Re-raised in the caller's thread
+            results.put((_DONE, error))
+        else:
+            results.put((_DONE, None))
+
+    thread = threading.Thread(target=run, name="GitHub async (%s)" % url, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item[0] is _DONE:
+                if item[1] is not None:
+                    raise item[1]
+                break
+            yield item
+    finally:
+        # Unblocks the event loop if the caller stopped early
+        stopped.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
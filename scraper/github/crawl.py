@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import json
+import logging
+import os
+
+from github3.repos.repo import ShortRepository
+
+from scraper.util import ordered_map
+
+logger = logging.getLogger(__name__)
+
+
+def _max_repository_id(gh_session):
+    """
+    Finds (roughly) the highest repository id on a server
+
+    The ``since`` parameter of the repository listing is used to binary
+    search for the last id that has a repository after it, which takes
+    about as many requests as the id has bits.
+    """
+
+    def exists_after(repo_id):
+        return any(True for _ in gh_session.all_repositories(number=1, since=repo_id))
+
+    high = 1024
+    while exists_after(high):
+        high *= 2
+
+    low = high // 2 if high > 1024 else 0
+    while high - low > 1:
+        middle = (low + high) // 2
+        if exists_after(middle):
+            low = middle
+        else:
+            high = middle
+
+    return high
+
+
+class RepositoryCrawl:
+    """
+    A resumable listing of every repository on a GitHub server
+
+    The repository id space is split into ``partitions`` ranges that are
+    listed concurrently, ``jobs`` at a time. Each range keeps its progress
+    in a JSON lines file under ``state_dir``: the repositories listed so far,
+    followed by an end marker once the range is complete. An interrupted
+    crawl started again with the same ``state_dir`` replays the listed
+    repositories and continues each range after the last of them. The range
+    files are removed once a crawl completes, so they only ever hold the
+    progress of a single run.
+
+    Several workers sharing ``state_dir`` (e.g. on shared storage) can split
+    the ranges between them by each passing ``worker=(index, count)``.
+    """
+
+    def __init__(self, gh_session, state_dir, partitions=16, jobs=4, worker=(0, 1)):
+        self.gh_session = gh_session
+        self.state_dir = state_dir
+        self.partitions = partitions
+        self.jobs = jobs
+        self.worker_index, self.worker_count = worker
+
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _ranges(self):
+        """
+        Returns the [start, stop) id ranges of the crawl
+
+        The ranges are fixed on the first run, so that later runs resume the
+        same partitions. The last range has no upper bound, which covers
+        repositories created since.
+        """
+        path = os.path.join(self.state_dir, "crawl.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fp:
+                bounds = json.load(fp)["bounds"]
+        else:
+            max_id = _max_repository_id(self.gh_session)
+            step = max_id // self.partitions + 1
+            bounds = [step * index for index in range(self.partitions)]
+            logger.info(
+                "Partitioning repository ids up to %d into %d ranges",
+                max_id,
+                len(bounds),
+            )
+            try:
+                with open(path, "x", encoding="utf-8") as fp:
+                    json.dump({"bounds": bounds}, fp)
+            except FileExistsError:
+                # Another worker got there first, share its ranges
+                return self._ranges()
+
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def _scan(self, path):
+        """
+        Returns the last repository id recorded in a range file, and if it is done
+
+        A partially written last line is dropped.
+        """
+        last_id = None
+        done = False
+        valid_size = 0
+
+        if not os.path.exists(path):
+            return last_id, done
+
+        with open(path, "rb") as fp:
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                valid_size += len(line)
+                if entry.get("done"):
+                    done = True
+                else:
+                    last_id = entry["id"]
+
+        if valid_size != os.path.getsize(path):
+            logger.warning("Truncating incomplete crawl entry: %s", path)
+            os.truncate(path, valid_size)
+
+        return last_id, done
+
+    def _path(self, bounds):
+        return os.path.join(self.state_dir, "range-%d.jsonl" % bounds[0])
+
+    def _crawl_range(self, bounds):
+        """
+        Lists the repositories with ids in a range into its file
+
+        Past progress is resumed. The open-ended last range is always listed
+        again from its last recorded repository, to pick up new ones.
+        """
+        start, stop = bounds
+        path = self._path(bounds)
+
+        last_id, done = self._scan(path)
+        if done and stop is not None:
+            logger.debug("Range %s-%s already crawled", start, stop)
+            return path
+
+        # Listings start after the ``since`` id
+        since = last_id if last_id is not None else max(start - 1, 0)
+        logger.info("Crawling repository ids %s-%s from %d", start, stop, since)
+
+        with open(path, "a", encoding="utf-8") as fp:
+            for repo in self.gh_session.all_repositories(since=since):
+                if stop is not None and repo.id >= stop:
+                    break
+                fp.write(json.dumps(repo.as_dict()) + "\n")
+                fp.flush()
+            fp.write(json.dumps({"done": True}) + "\n")
+
+        return path
+
+    def _read(self, path):
+        """
+        Yields the repository documents recorded in a range file
+        """
+        with open(path, encoding="utf-8") as fp:
+            for line in fp:
+                entry = json.loads(line)
+                if not entry.get("done"):
+                    yield entry
+
+    def repositories(self):
+        """
+        Yields GitHub3.py repo objects for this worker's ranges, in id order
+
+        Once every range has been yielded, the range files are removed, so
+        the next crawl lists the server afresh.
+        """
+        ranges = [
+            bounds
+            for index, bounds in enumerate(self._ranges())
+            if index % self.worker_count == self.worker_index
+        ]
+
+        for path in ordered_map(self._crawl_range, ranges, self.jobs):
+            for repo_json in self._read(path):
+                yield ShortRepository(repo_json, self.gh_session)
+
+        for bounds in ranges:
+            os.remove(self._path(bounds))
+        logger.info("Crawl complete, cleared %d range files", len(ranges))
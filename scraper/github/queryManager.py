@@ -5,7 +5,9 @@ With this module, you will be able to send GraphQL and REST queries
 to GitHub, as well as read and write JSON files to store data.
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+import hashlib
 import json
 import os
 import re
@@ -13,8 +15,12 @@ import time
 
 import pytz
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from scraper.util import DEFAULT_REQUESTS_TIMEOUTS
+from scraper.cache import DiskCache
+from scraper.github.ratelimit import AdaptiveConcurrency, secondary_limit_wait
+from scraper.util import DEFAULT_REQUESTS_TIMEOUTS, ordered_map
 
 
 def _vPrint(verbose, *args, **kwargs):
@@ -30,10 +36,114 @@ def _vPrint(verbose, *args, **kwargs):
         print(*args, **kwargs)
 
 
+def _listAt(obj, keys):
+    """Follow a list of keys into a JSON style dictionary.
+
+    Args:
+        obj (Dict): A JSON style dictionary.
+        keys (List[str]): Ordered list of keys to follow.
+
+    Returns:
+        The value found at the end of the keys.
+
+    """
+    for key in keys:
+        obj = obj[key]
+    return obj
+
+
+def _closeBrace(text, start):
+    """Find the closing brace matching the opening brace at 'start'.
+
+    Args:
+        text (str): A GraphQL document.
+        start (int): Index of an opening brace in 'text'.
+
+    Returns:
+        int: Index of the matching closing brace.
+
+    """
+    depth = 0
+    inString = False
+    index = start
+    while index < len(text):
+        char = text[index]
+        if inString:
+            if char == "\\":
+                index += 1
+            elif char == '"':
+                inString = False
+        elif char == '"':
+            inString = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    raise ValueError("Unbalanced braces in GraphQL query.")
+
+
+def _batchGQL(gitquery):
+    """Split a GraphQL query into the parts needed to batch it.
+
+    Args:
+        gitquery (str): A single line GraphQL query, with a selection set
+            on each of its top level fields.
+
+    Returns:
+        Tuple[str, List[Tuple[str, str, str]], str]: The variable
+        definitions, the (key, field, rest) of each top level selection
+        where 'key' is the alias or name of the field, and any fragment
+        definitions following the query.
+
+    """
+    operation = re.match(r"\s*query\s*(?:\w+\s*)?(?:\((.*?)\))?\s*\{", gitquery)
+    if not operation:
+        raise ValueError("Only GraphQL 'query' operations can be batched.")
+    bodyStart = operation.end()
+    bodyEnd = _closeBrace(gitquery, bodyStart - 1)
+    body = gitquery[bodyStart:bodyEnd]
+    fragments = gitquery[bodyEnd:].lstrip("}").strip()
+
+    selections = []
+    index = 0
+    while body[index:].strip():
+        field = re.compile(r"\s*(?:(\w+)\s*:\s*)?(\w+)").match(body, index)
+        selectionStart = body.find("{", index)
+        if not field or selectionStart < 0:
+            raise ValueError(
+                "Every top level field of a batched query needs a selection set."
+            )
+        fieldEnd = field.end()
+        index = _closeBrace(body, selectionStart) + 1
+        alias, name = field.groups()
+        selections.append((alias or name, name, body[fieldEnd:index]))
+
+    return operation.group(1) or "", selections, fragments
+
+
+# Largest number of nodes GitHub allows a single GraphQL query to request
+_MAX_NODES = 500000
+
+# GraphQL error types of queries requesting too much at once
+_LIMIT_ERRORS = ("MAX_NODE_LIMIT_EXCEEDED", "RESOURCE_LIMITS_EXCEEDED")
+
+
 class GitHubQueryManager:
     """GitHub query API manager."""
 
-    def __init__(self, apiToken=None, maxRetry=10, retryDelay=3):
+    def __init__(
+        self,
+        apiToken=None,
+        maxRetry=10,
+        retryDelay=3,
+        poolSize=10,
+        cachePath=None,
+        cacheTTL=3600,
+        cacheSize=10000,
+    ):
         """Initialize the GitHubQueryManager object.
 
         Note:
@@ -47,6 +157,16 @@ class GitHubQueryManager:
                 automatically retry requests. Defaults to 10.
             retryDelay (Optional[int]): Number of seconds to wait between
                 automatic request retries. Defaults to 3.
+            poolSize (Optional[int]): Number of connections to GitHub kept
+                open for reuse. Defaults to 10.
+            cachePath (Optional[str]): Path to a SQLite database caching
+                successful responses, so that repeated queries are answered
+                without a request. Defaults to None (no cache).
+            cacheTTL (Optional[int]): Number of seconds cached responses are
+                used for, may be overridden per query. None never expires
+                them. Defaults to 3600.
+            cacheSize (Optional[int]): Number of responses cached, the least
+                recently used are evicted beyond it. Defaults to 10000.
 
         Raises:
             TypeError: If no GitHub API token is provided either via
@@ -54,6 +174,9 @@ class GitHubQueryManager:
 
         """
 
+        self.concurrency = AdaptiveConcurrency()
+        """AdaptiveConcurrency: Limit on requests in flight, lowered on secondary rate limits."""
+
         # Get GitHub API token
         if apiToken:
             self.__githubApiToken = apiToken
@@ -65,6 +188,32 @@ class GitHubQueryManager:
                     "Requires either a string argument or environment variable 'GITHUB_API_TOKEN'."
                 ) from error
 
+        self.cache = None
+        """DiskCache: Responses of previous queries, if 'cachePath' was given."""
+        if cachePath:
+            self.cache = DiskCache(cachePath, "github_queries", max_entries=cacheSize)
+        self.cacheTTL = cacheTTL
+
+        # Reuse connections (and compress responses) across queries
+        self._session = requests.Session()
+        self._session.headers.update(
+            {
+                "Authorization": "bearer " + self.__githubApiToken,
+                "Accept-Encoding": "gzip, deflate",
+            }
+        )
+        self._session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=poolSize,
+                # Only connection failures, the responses are checked by queryGitHub
+                max_retries=Retry(
+                    total=None, connect=3, read=False, status=0, backoff_factor=0.5
+                ),
+            ),
+        )
+
         # Check token validity
         print("Checking GitHub API token... ", end="", flush=True)
         basicCheck = self._submitQuery("query { viewer { login } }")
@@ -118,6 +267,26 @@ class GitHubQueryManager:
         self.__retryDelay = numIn
         print("Auto-retry delay set to %dsec." % (self.retryDelay))
 
+    @property
+    def connectionStats(self):
+        """Dict: Number of 'requests' sent and of 'connections' opened to GitHub.
+
+        Requests beyond the number of connections reused an open connection.
+        """
+        pools = self._session.get_adapter("https://api.github.com").poolmanager.pools
+        stats = {"requests": 0, "connections": 0}
+        for key in pools.keys():
+            pool = pools[key]
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+        return stats
+
+    def close(self):
+        """Close the connections kept open to GitHub, and the cache."""
+        self._session.close()
+        if self.cache is not None:
+            self.cache.close()
+
     def _readGQL(self, filePath, verbose=False):
         """Read a 'pretty' formatted GraphQL query file into a one-line string.
 
@@ -195,6 +364,236 @@ class GitHubQueryManager:
             gitquery, gitvars=gitvars, verbosity=verbosity, **kwargs
         )
 
+    def queryGitHubMany(self, queries, maxInFlight=8, stream=False, **kwargs):
+        """Submit many GitHub queries concurrently.
+
+        Every query goes through 'queryGitHub', sharing its retries and
+        rate limit handling. The number of requests actually in flight is
+        further limited by 'concurrency', which backs off on secondary rate
+        limits.
+
+        Args:
+            queries (Iterable[Union[str, Dict]]): The queries to submit.
+                Each is either a query or endpoint string, or a dictionary
+                of keyword arguments for the 'queryGitHub' method, which may
+                give a 'filePath' to read the query from instead of a
+                'gitquery'.
+                Example:
+                    [{'filePath': 'repo.gql', 'gitvars': {'name': 'scraper'}}]
+            maxInFlight (Optional[int]): Number of queries submitted at
+                once. Defaults to 8.
+            stream (Optional[bool]): If True, returns a generator yielding
+                (index, result) pairs in the order the queries complete.
+                Defaults to False.
+            **kwargs: Keyword arguments for the 'queryGitHub' method,
+                shared by all queries.
+
+        Returns:
+            List[Dict]: The result of each query, in input order.
+
+        """
+
+        def prepare(query):
+            if isinstance(query, str):
+                query = {"gitquery": query}
+            query = {**kwargs, **query}
+            filePath = query.pop("filePath", None)
+            if filePath:
+                query["gitquery"] = self._readGQL(
+                    filePath, verbose=(query.get("verbosity", 0) >= 0)
+                )
+            return query
+
+        def submit(query):
+            return self.queryGitHub(**query)
+
+        # Queries are prepared as they are submitted, from this thread
+        queries = (prepare(query) for query in queries)
+        if stream:
+            return self._streamQueries(submit, queries, maxInFlight)
+        return list(ordered_map(submit, queries, maxInFlight))
+
+    def _streamQueries(self, submit, queries, maxInFlight):
+        """Yield (index, result) pairs of queries as they complete.
+
+        Only a bounded window of queries is submitted ahead of the results.
+        """
+        with ThreadPoolExecutor(max_workers=maxInFlight) as executor:
+            pending = {}
+            for index, query in enumerate(queries):
+                pending[executor.submit(submit, query)] = index
+                if len(pending) >= 2 * maxInFlight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+    def queryGitHubBatchFromFile(self, filePath, gitvarsList, verbosity=0, **kwargs):
+        """Submit a GitHub GraphQL query from a file once per set of variables.
+
+        Args:
+            filePath (str): A relative or absolute path to a file containing
+                a GraphQL query.
+            gitvarsList (List[Dict]): The query variables of each call.
+            verbosity (Optional[int]): Changes output verbosity levels.
+                Defaults to 0.
+            **kwargs: Keyword arguments for the 'queryGitHubBatch' method.
+
+        Returns:
+            List[Dict]: A JSON style dictionary for each call, in order.
+
+        """
+        gitquery = self._readGQL(filePath, verbose=(verbosity >= 0))
+        return self.queryGitHubBatch(
+            gitquery, gitvarsList, verbosity=verbosity, **kwargs
+        )
+
+    def queryGitHubBatch(
+        self, gitquery, gitvarsList, batchSize=50, verbosity=0, headers=None
+    ):
+        """Submit a GitHub GraphQL query once per set of variables, in batches.
+
+        Calls are merged into aliased GraphQL documents, so that a batch of
+        them takes a single round trip. The batch size is fit to GitHub's
+        limit on the nodes a single query may request (measured on the
+        first call, which is sent alone), and halved if a batch still
+        exceeds GitHub's node or resource limits. Batched queries can't be
+        paginated, and each of their top level fields needs a selection set.
+
+        A GraphQL error in one call (e.g. a repository that was not found)
+        does not fail the others: it is returned in the 'errors' of that
+        call's result, with its path relative to the call.
+
+        Args:
+            gitquery (str): The GraphQL query itself.
+                Example:
+                    'query ($owner: String!, $name: String!) {
+                        repository(owner: $owner, name: $name) { id } }'
+            gitvarsList (List[Dict]): The query variables of each call.
+            batchSize (Optional[int]): The largest number of calls merged
+                into a single query. Defaults to 50.
+            verbosity (Optional[int]): Changes output verbosity levels.
+                Defaults to 0.
+            headers (Optional[Dict]): Additional headers.
+                Defaults to None.
+
+        Returns:
+            List[Dict]: A JSON style dictionary for each call, in order,
+            with the 'data' (and any 'errors') of the call.
+
+        """
+        varDefs, selections, fragments = _batchGQL(gitquery)
+        varNames = re.findall(r"\$(\w+)\s*:", varDefs)
+        varPattern = re.compile(r"\$(%s)\b" % "|".join(varNames or ["(?!)"]))
+
+        def batch(calls, extraFields=""):
+            defs = []
+            fields = []
+            variables = {}
+            for index, gitvars in calls:
+
+                def rename(text, index=index):
+                    return varPattern.sub(
+                        lambda match: "$%s_%d" % (match.group(1), index), text
+                    )
+
+                defs.append(rename(varDefs))
+                for key, name, rest in selections:
+                    fields.append("b%d_%s: %s%s" % (index, key, name, rename(rest)))
+                for name in varNames:
+                    if name in gitvars:
+                        variables["%s_%d" % (name, index)] = gitvars[name]
+
+            if extraFields:
+                fields.append(extraFields)
+            query = "query %s{ %s } %s" % (
+                "(%s) " % " ".join(defs) if varNames else "",
+                " ".join(fields),
+                fragments,
+            )
+            return query.strip(), variables
+
+        results = [None] * len(gitvarsList)
+        pending = list(enumerate(gitvarsList))
+        # The first call is sent alone, measuring the nodes each call requests
+        measure = len(pending) > 1
+        while pending:
+            size = 1 if measure else batchSize
+            calls, pending = pending[:size], pending[size:]
+            query, variables = batch(
+                calls, "batchCost: rateLimit { nodeCount }" if measure else ""
+            )
+            _vPrint(
+                (verbosity >= 0),
+                "Batch of %d calls, %d remaining" % (len(calls), len(pending)),
+            )
+            outObj, _ = self._queryPage(
+                query,
+                variables,
+                verbosity,
+                False,
+                False,
+                0,
+                1,
+                headers or {},
+                None,
+                False,
+                allowErrors=True,
+            )
+            data = outObj.get("data")
+            errors = outObj.get("errors", [])
+
+            if data is None:
+                limited = any(error.get("type") in _LIMIT_ERRORS for error in errors)
+                if not limited or len(calls) == 1:
+                    raise RuntimeError("GraphQL API error.\n%s" % (json.dumps(errors)))
+                # Too large for a single query
+                batchSize = max(1, len(calls) // 2)
+                _vPrint(
+                    (verbosity >= 0),
+                    "Batch too large, retrying in batches of %d calls." % (batchSize),
+                )
+                pending = calls + pending
+                continue
+
+            if measure:
+                measure = False
+                nodeCount = (data.get("batchCost") or {}).get("nodeCount")
+                if nodeCount:
+                    batchSize = max(1, min(batchSize, _MAX_NODES // nodeCount))
+                    _vPrint(
+                        (verbosity >= 0),
+                        "Each call requests %d nodes, batching %d calls per query."
+                        % (nodeCount, batchSize),
+                    )
+
+            for index, _ in calls:
+                results[index] = {
+                    "data": {
+                        key: data.get("b%d_%s" % (index, key))
+                        for key, _, _ in selections
+                    }
+                }
+
+            # Errors are reported by call, along with the results of the others
+            for error in errors:
+                path = error.get("path") or []
+                alias = re.match(r"b(\d+)_(\w+)$", str(path[0])) if path else None
+                if alias:
+                    index = int(alias.group(1))
+                    error = dict(error, path=[alias.group(2)] + path[1:])
+                    targets = [index]
+                else:
+                    targets = [index for index, _ in calls]
+                for index in targets:
+                    results[index].setdefault("errors", []).append(error)
+
+        return results
+
     def queryGitHub(
         self,
         gitquery,
@@ -207,6 +606,8 @@ class GitHubQueryManager:
         requestCount=0,
         pageNum=0,
         headers=None,
+        cacheTTL=None,
+        bypassCache=False,
     ):
         """Submit a GitHub query.
 
@@ -241,10 +642,104 @@ class GitHubQueryManager:
                 For user readable log messages only, does not affect data.
             headers (Optional[Dict]): Additional headers.
                 Defaults to None.
+            cacheTTL (Optional[int]): Number of seconds a cached response
+                to this query is used for. Defaults to the manager's
+                'cacheTTL'.
+            bypassCache (Optional[bool]): If True, the query is always sent,
+                and its response replaces any cached one. Defaults to False.
 
         Returns:
             Dict: A JSON style dictionary.
 
+        """
+        if not keysToList:
+            keysToList = []
+
+        outObj = None
+        for page in self.iterQueryGitHub(
+            gitquery,
+            gitvars=gitvars,
+            verbosity=verbosity,
+            paginate=paginate,
+            cursorVar=cursorVar,
+            keysToList=keysToList,
+            rest=rest,
+            requestCount=requestCount,
+            pageNum=pageNum,
+            headers=headers,
+            cacheTTL=cacheTTL,
+            bypassCache=bypassCache,
+        ):
+            if outObj is None:
+                outObj = page
+            elif rest:
+                outObj.extend(page)
+            else:
+                outList = _listAt(outObj, keysToList)
+                outList.extend(_listAt(page, keysToList))
+
+        if paginate and not rest:
+            _listAt(outObj, keysToList[0:-1]).pop("pageInfo", None)
+
+        return outObj
+
+    def iterQueryGitHub(
+        self,
+        gitquery,
+        gitvars=None,
+        verbosity=0,
+        paginate=False,
+        cursorVar=None,
+        keysToList=None,
+        rest=False,
+        requestCount=0,
+        pageNum=0,
+        headers=None,
+        nodes=False,
+        cacheTTL=None,
+        bypassCache=False,
+    ):
+        """Submit a GitHub query, yielding each page of results as it arrives.
+
+        Pages are requested one at a time as the generator is advanced, so
+        only the current page is held in memory.
+
+        Args:
+            gitquery (str): The query or endpoint itself.
+            gitvars (Optional[Dict]): All query variables.
+                Defaults to None.
+                GraphQL Only.
+            verbosity (Optional[int]): Changes output verbosity levels.
+                Defaults to 0.
+            paginate (Optional[bool]): Pagination will be followed
+                automatically if True. Defaults to False.
+            cursorVar (Optional[str]): Key in 'gitvars' that represents the
+                pagination cursor. Defaults to None.
+                GraphQL Only.
+            keysToList (Optional[List[str]]): Ordered list of keys needed to
+                retrieve the list in the query results. Defaults to None.
+                GraphQL Only.
+            rest (Optional[bool]): If True, uses the REST API instead
+                of GraphQL. Defaults to False.
+            requestCount (Optional[int]): Counter for repeated requests of
+                the first page.
+            pageNum (Optional[int]): Counter for pagination.
+                For user readable log messages only, does not affect data.
+            headers (Optional[Dict]): Additional headers.
+                Defaults to None.
+            nodes (Optional[bool]): If True, yields the individual items of
+                each page (the REST response list, or the GraphQL list at
+                'keysToList') instead of whole pages. Defaults to False.
+            cacheTTL (Optional[int]): Number of seconds a cached response
+                to this query is used for. Defaults to the manager's
+                'cacheTTL'.
+            bypassCache (Optional[bool]): If True, the query is always sent,
+                and its response replaces any cached one. Defaults to False.
+
+        Yields:
+            Dict: A JSON style dictionary for each page, or each item of
+            each page if 'nodes' is True.
+
         """
         if not gitvars:
             gitvars = {}
@@ -253,267 +748,304 @@ class GitHubQueryManager:
         if not headers:
             headers = {}
 
-        requestCount += 1
-        pageNum = 0 if pageNum < 0 else pageNum  # no negative page numbers
-        pageNum += 1
-
-        if paginate:
-            _vPrint((verbosity >= 0), "Page %d" % (pageNum))
-        _vPrint(
-            (verbosity >= 0), "Sending %s query..." % ("REST" if rest else "GraphQL")
-        )
-        try:
-            response = self._submitQuery(
-                gitquery,
-                gitvars=gitvars,
-                verbose=(verbosity > 0),
-                rest=rest,
-                headers=headers,
+        if paginate and not rest:
+            if not cursorVar:
+                raise ValueError(
+                    "Must specify argument 'cursorVar' to use GraphQL auto-pagination."
+                )
+            if not len(keysToList) > 0:
+                raise ValueError(
+                    "Must specify argument 'keysToList' as a non-empty list to use GraphQL auto-pagination."
+                )
+        if nodes and not rest and not len(keysToList) > 0:
+            raise ValueError(
+                "Must specify argument 'keysToList' as a non-empty list to iterate GraphQL nodes."
             )
-        except requests.exceptions.ReadTimeout:  # Handles intermittent response delays
-            _vPrint((verbosity >= 0), "Read timed out.")
-            _vPrint((verbosity >= 0), "Repeating query...")
-            return self.queryGitHub(
+
+        pageNum = 0 if pageNum < 0 else pageNum  # no negative page numbers
+        while gitquery:
+            pageNum += 1
+            outObj, response = self._queryPage(
                 gitquery,
                 gitvars=gitvars,
                 verbosity=verbosity,
                 paginate=paginate,
-                cursorVar=cursorVar,
-                keysToList=keysToList,
                 rest=rest,
                 requestCount=requestCount,
-                pageNum=(pageNum - 1),  # retry same page
+                pageNum=pageNum,
                 headers=headers,
+                cacheTTL=cacheTTL,
+                bypassCache=bypassCache,
             )
-        _vPrint((verbosity >= 0), "Checking response...")
-        _vPrint((verbosity >= 0), "HTTP STATUS %s" % (response["statusTxt"]))
-        statusNum = response["statusNum"]
-
-        # Make sure the query limit didn't run out
-        try:
-            apiStatus = {
-                "limit": int(response["headDict"]["X-RateLimit-Limit"]),
-                "remaining": int(response["headDict"]["X-RateLimit-Remaining"]),
-                "reset": int(response["headDict"]["X-RateLimit-Reset"]),
-            }
-            _vPrint((verbosity >= 0), "API Status %s" % (json.dumps(apiStatus)))
-            if apiStatus["remaining"] <= 0:
-                _vPrint((verbosity >= 0), "API rate limit exceeded.")
-                self._awaitReset(apiStatus["reset"])
-                _vPrint((verbosity >= 0), "Repeating query...")
-                return self.queryGitHub(
+            requestCount = 0
+
+            # Find the next page before handing this one over
+            nextQuery = None
+            if paginate and rest:
+                if response["linkDict"] and "next" in response["linkDict"]:
+                    nextQuery = response["linkDict"]["next"]
+            elif paginate:
+                pageInfo = _listAt(outObj, keysToList[0:-1])["pageInfo"]
+                gitvars[cursorVar] = pageInfo["endCursor"]
+                if pageInfo["hasNextPage"]:
+                    nextQuery = gitquery
+
+            if not nodes:
+                yield outObj
+            elif rest:
+                yield from outObj
+            else:
+                yield from _listAt(outObj, keysToList)
+
+            gitquery = nextQuery
+
+    def _queryPage(
+        self,
+        gitquery,
+        gitvars,
+        verbosity,
+        paginate,
+        rest,
+        requestCount,
+        pageNum,
+        headers,
+        cacheTTL,
+        bypassCache,
+        allowErrors=False,
+    ):
+        """Submit a single GitHub query, unless its response is cached.
+
+        GraphQL mutations are always sent, and their responses not cached.
+        Nor are responses reporting GraphQL errors (with 'allowErrors').
+
+        Returns:
+            Tuple[Dict, Dict]: The decoded response body, and the response
+            as returned by '_submitQuery' (only its 'linkDict' if cached).
+
+        """
+        # Mutations have side effects, only the results of reads are reused
+        mutation = not rest and re.match(r"\s*mutation\b", gitquery)
+        if self.cache is None or mutation:
+            return self._fetchPage(
+                gitquery,
+                gitvars,
+                verbosity,
+                paginate,
+                rest,
+                requestCount,
+                pageNum,
+                headers,
+                allowErrors,
+            )
+
+        # Identical queries, variables and headers (for the same token)
+        # get identical responses
+        cacheKey = hashlib.sha256(
+            json.dumps(
+                [
+                    self.__githubApiToken,
+                    rest,
+                    re.sub(r"\s+", " ", gitquery).strip(),
+                    gitvars,
+                    {key.lower(): value for key, value in headers.items()},
+                ],
+                sort_keys=True,
+            ).encode("utf-8")
+        ).hexdigest()
+        if cacheTTL is None:
+            cacheTTL = self.cacheTTL
+
+        if not bypassCache:
+            cached = self.cache.get(cacheKey, max_age=cacheTTL)
+            if cached is not None:
+                _vPrint((verbosity >= 0), "Using cached response.")
+                return cached["result"], {"linkDict": cached["linkDict"]}
+
+        outObj, response = self._fetchPage(
+            gitquery,
+            gitvars,
+            verbosity,
+            paginate,
+            rest,
+            requestCount,
+            pageNum,
+            headers,
+            allowErrors,
+        )
+        # Errors may be transient, so partial results are not replayed
+        if rest or "errors" not in outObj:
+            self.cache.set(
+                cacheKey, {"result": outObj, "linkDict": response["linkDict"]}
+            )
+        return outObj, response
+
+    def _fetchPage(
+        self,
+        gitquery,
+        gitvars,
+        verbosity,
+        paginate,
+        rest,
+        requestCount,
+        pageNum,
+        headers,
+        allowErrors=False,
+    ):
+        """Submit a single GitHub query, retrying until it succeeds.
+
+        If 'allowErrors' is True, GraphQL responses reporting errors are
+        returned rather than raised, unless they are worth retrying.
+
+        Returns:
+            Tuple[Dict, Dict]: The decoded response body, and the response
+            as returned by '_submitQuery'.
+
+        """
+        while True:
+            requestCount += 1
+
+            if paginate:
+                _vPrint((verbosity >= 0), "Page %d" % (pageNum))
+            _vPrint(
+                (verbosity >= 0),
+                "Sending %s query..." % ("REST" if rest else "GraphQL"),
+            )
+            try:
+                response = self._submitQuery(
                     gitquery,
                     gitvars=gitvars,
-                    verbosity=verbosity,
-                    paginate=paginate,
-                    cursorVar=cursorVar,
-                    keysToList=keysToList,
+                    verbose=(verbosity > 0),
                     rest=rest,
-                    requestCount=(requestCount - 1),  # not counted against retries
-                    pageNum=(pageNum - 1),  # retry same page
                     headers=headers,
                 )
-        except KeyError:  # Handles error responses without X-RateLimit data
-            _vPrint((verbosity >= 0), "Failed to check API Status.")
+            except requests.exceptions.ReadTimeout:
+                # Handles intermittent response delays
+                _vPrint((verbosity >= 0), "Read timed out.")
+                _vPrint((verbosity >= 0), "Repeating query...")
+                continue
+            _vPrint((verbosity >= 0), "Checking response...")
+            _vPrint((verbosity >= 0), "HTTP STATUS %s" % (response["statusTxt"]))
+            statusNum = response["statusNum"]
 
-        # Check for explicit API rate limit error responses
-        if statusNum in (403, 429):
-            _vPrint((verbosity >= 0), "API rate limit exceeded.")
-            if requestCount >= self.maxRetry:
-                raise RuntimeError(
-                    "Query attempted but failed %d times.\n%s\n%s"
-                    % (
-                        self.maxRetry,
-                        response["statusTxt"],
-                        response["result"],
-                    )
-                )
+            # Make sure the query limit didn't run out
+            try:
+                apiStatus = {
+                    "limit": int(response["headDict"]["X-RateLimit-Limit"]),
+                    "remaining": int(response["headDict"]["X-RateLimit-Remaining"]),
+                    "reset": int(response["headDict"]["X-RateLimit-Reset"]),
+                }
+                _vPrint((verbosity >= 0), "API Status %s" % (json.dumps(apiStatus)))
+                if apiStatus["remaining"] <= 0:
+                    _vPrint((verbosity >= 0), "API rate limit exceeded.")
+                    self._awaitReset(apiStatus["reset"])
+                    _vPrint((verbosity >= 0), "Repeating query...")
+                    requestCount -= 1  # not counted against retries
+                    continue
+            except KeyError:  # Handles error responses without X-RateLimit data
+                _vPrint((verbosity >= 0), "Failed to check API Status.")
+
+            # Check for explicit API rate limit error responses
+            if statusNum in (403, 429):
+                _vPrint((verbosity >= 0), "API rate limit exceeded.")
+                self._checkRetries(requestCount, response)
 
-            try:  # Use explicit wait time if available
-                waitTime = int(response["headDict"]["Retry-After"])
+                secondaryWait = secondary_limit_wait(
+                    statusNum, response["headDict"], response["result"]
+                )
+                if secondaryWait is not None:
+                    self.concurrency.backoff(secondaryWait)
+
+                try:  # Use explicit wait time if available
+                    waitTime = int(response["headDict"]["Retry-After"])
+                    self._countdown(
+                        waitTime,
+                        printString="Waiting %*d seconds...",
+                        verbose=(verbosity >= 0),
+                    )
+                except KeyError:  # Handles missing Retry-After header
+                    self._countdown(
+                        # wait at least 1 min, longer on continued failure (recommended best practice)
+                        60 * requestCount,
+                        printString="Waiting %*d seconds...",
+                        verbose=(verbosity >= 0),
+                    )
+                _vPrint((verbosity >= 0), "Repeating query...")
+                continue
+            # Check for accepted but not yet processed, usually due to un-cached data
+            if statusNum == 202:
+                self._checkRetries(requestCount, response)
                 self._countdown(
-                    waitTime,
-                    printString="Waiting %*d seconds...",
+                    self.retryDelay,
+                    printString="Query accepted but not yet processed. Trying again in %*d seconds...",
                     verbose=(verbosity >= 0),
                 )
-            except KeyError:  # Handles missing Retry-After header
+                continue
+            # Check for server error responses
+            if statusNum in (502, 503):
+                self._checkRetries(requestCount, response)
                 self._countdown(
-                    # wait at least 1 min, longer on continued failure (recommended best practice)
-                    60 * requestCount,
-                    printString="Waiting %*d seconds...",
+                    self.retryDelay,
+                    printString="Server error. Trying again in %*d seconds...",
                     verbose=(verbosity >= 0),
                 )
-            _vPrint((verbosity >= 0), "Repeating query...")
-            return self.queryGitHub(
-                gitquery,
-                gitvars=gitvars,
-                verbosity=verbosity,
-                paginate=paginate,
-                cursorVar=cursorVar,
-                keysToList=keysToList,
-                rest=rest,
-                requestCount=requestCount,
-                pageNum=(pageNum - 1),  # retry same page
-                headers=headers,
-            )
-        # Check for accepted but not yet processed, usually due to un-cached data
-        if statusNum == 202:
-            if requestCount >= self.maxRetry:
+                continue
+            # Check for other error responses
+            if statusNum >= 400 or statusNum == 204:
                 raise RuntimeError(
-                    "Query attempted but failed %d times.\n%s\n%s"
-                    % (
-                        self.maxRetry,
-                        response["statusTxt"],
-                        response["result"],
-                    )
+                    "Request got an Error response.\n%s\n%s"
+                    % (response["statusTxt"], response["result"])
                 )
 
-            self._countdown(
-                self.retryDelay,
-                printString="Query accepted but not yet processed. Trying again in %*d seconds...",
-                verbose=(verbosity >= 0),
-            )
-            return self.queryGitHub(
-                gitquery,
-                gitvars=gitvars,
-                verbosity=verbosity,
-                paginate=paginate,
-                cursorVar=cursorVar,
-                keysToList=keysToList,
-                rest=rest,
-                requestCount=requestCount,
-                pageNum=(pageNum - 1),  # retry same page
-                headers=headers,
-            )
-        # Check for server error responses
-        if statusNum in (502, 503):
-            if requestCount >= self.maxRetry:
-                raise RuntimeError(
-                    "Query attempted but failed %d times.\n%s\n%s"
-                    % (
-                        self.maxRetry,
-                        response["statusTxt"],
-                        response["result"],
-                    )
-                )
+            self.concurrency.success()
+            _vPrint((verbosity >= 0), "Data received!")
+            outObj = json.loads(response["result"])
 
-            self._countdown(
-                self.retryDelay,
-                printString="Server error. Trying again in %*d seconds...",
-                verbose=(verbosity >= 0),
-            )
-            return self.queryGitHub(
-                gitquery,
-                gitvars=gitvars,
-                verbosity=verbosity,
-                paginate=paginate,
-                cursorVar=cursorVar,
-                keysToList=keysToList,
-                rest=rest,
-                requestCount=requestCount,
-                pageNum=(pageNum - 1),  # retry same page
-                headers=headers,
-            )
-        # Check for other error responses
-        if statusNum >= 400 or statusNum == 204:
-            raise RuntimeError(
-                "Request got an Error response.\n%s\n%s"
-                % (response["statusTxt"], response["result"])
-            )
+            # Check for GraphQL API errors (e.g. repo not found)
+            if not rest and "errors" in outObj:
+                if allowErrors and outObj.get("data") is not None:
+                    # Partial results, along with the errors of the rest
+                    return outObj, response
 
-        _vPrint((verbosity >= 0), "Data received!")
-        outObj = json.loads(response["result"])
+                self._checkRetries(requestCount, response)
 
-        # Check for GraphQL API errors (e.g. repo not found)
-        if not rest and "errors" in outObj:
-            if requestCount >= self.maxRetry:
-                raise RuntimeError(
-                    "Query attempted but failed %d times.\n%s\n%s"
-                    % (
-                        self.maxRetry,
-                        response["statusTxt"],
-                        response["result"],
+                if len(outObj["errors"]) == 1 and len(outObj["errors"][0]) == 1:
+                    # Poorly defined error type, usually intermittent, try again.
+                    _vPrint(
+                        (verbosity >= 0),
+                        "GraphQL API error.\n%s" % (json.dumps(outObj["errors"])),
                     )
-                )
+                    self._countdown(
+                        self.retryDelay,
+                        printString="Unknown API error. Trying again in %*d seconds...",
+                        verbose=(verbosity >= 0),
+                    )
+                    continue
 
-            if len(outObj["errors"]) == 1 and len(outObj["errors"][0]) == 1:
-                # Poorly defined error type, usually intermittent, try again.
-                _vPrint(
-                    (verbosity >= 0),
-                    "GraphQL API error.\n%s" % (json.dumps(outObj["errors"])),
-                )
-                self._countdown(
-                    self.retryDelay,
-                    printString="Unknown API error. Trying again in %*d seconds...",
-                    verbose=(verbosity >= 0),
-                )
-                return self.queryGitHub(
-                    gitquery,
-                    gitvars=gitvars,
-                    verbosity=verbosity,
-                    paginate=paginate,
-                    cursorVar=cursorVar,
-                    keysToList=keysToList,
-                    rest=rest,
-                    requestCount=requestCount,
-                    pageNum=(pageNum - 1),  # retry same page
-                    headers=headers,
+                if allowErrors:
+                    return outObj, response
+                raise RuntimeError(
+                    "GraphQL API error.\n%s" % (json.dumps(outObj["errors"]))
                 )
 
-            raise RuntimeError(
-                "GraphQL API error.\n%s" % (json.dumps(outObj["errors"]))
-            )
+            return outObj, response
 
-        # Pagination
-        if paginate:
-            if rest and response["linkDict"]:
-                if "next" in response["linkDict"]:
-                    nextObj = self.queryGitHub(
-                        response["linkDict"]["next"],
-                        gitvars=gitvars,
-                        verbosity=verbosity,
-                        paginate=paginate,
-                        cursorVar=cursorVar,
-                        keysToList=keysToList,
-                        rest=rest,
-                        requestCount=0,
-                        pageNum=pageNum,
-                        headers=headers,
-                    )
-                    outObj.extend(nextObj)
-            elif not rest:
-                if not cursorVar:
-                    raise ValueError(
-                        "Must specify argument 'cursorVar' to use GraphQL auto-pagination."
-                    )
-                if not len(keysToList) > 0:
-                    raise ValueError(
-                        "Must specify argument 'keysToList' as a non-empty list to use GraphQL auto-pagination."
-                    )
-                aPage = outObj
-                for key in keysToList[0:-1]:
-                    aPage = aPage[key]
-                gitvars[cursorVar] = aPage["pageInfo"]["endCursor"]
-                if aPage["pageInfo"]["hasNextPage"]:
-                    nextObj = self.queryGitHub(
-                        gitquery,
-                        gitvars=gitvars,
-                        verbosity=verbosity,
-                        paginate=paginate,
-                        cursorVar=cursorVar,
-                        keysToList=keysToList,
-                        rest=rest,
-                        requestCount=0,
-                        pageNum=pageNum,
-                        headers=headers,
-                    )
-                    newPage = nextObj
-                    for key in keysToList[0:-1]:
-                        newPage = newPage[key]
-                    aPage[keysToList[-1]].extend(newPage[keysToList[-1]])
-                aPage.pop("pageInfo", None)
+    def _checkRetries(self, requestCount, response):
+        """Raise an error if a query has been attempted too many times.
 
-        return outObj
+        Args:
+            requestCount (int): Number of times the query was attempted.
+            response (Dict): The last response, as returned by '_submitQuery'.
+
+        """
+        if requestCount >= self.maxRetry:
+            raise RuntimeError(
+                "Query attempted but failed %d times.\n%s\n%s"
+                % (
+                    self.maxRetry,
+                    response["statusTxt"],
+                    response["result"],
+                )
+            )
 
     def _submitQuery(
         self, gitquery, gitvars=None, verbose=False, rest=False, headers=None
@@ -549,23 +1081,23 @@ class GitHubQueryManager:
         if not headers:
             headers = {}
 
-        authhead = {"Authorization": "bearer " + self.__githubApiToken}
-        if not rest:
-            gitqueryJSON = json.dumps(
-                {"query": gitquery, "variables": json.dumps(gitvars)}
-            )
-            fullResponse = requests.post(
-                "https://api.github.com/graphql",
-                data=gitqueryJSON,
-                headers={**authhead, **headers},
-                timeout=DEFAULT_REQUESTS_TIMEOUTS,
-            )
-        else:
-            fullResponse = requests.get(
-                "https://api.github.com" + gitquery,
-                headers={**authhead, **headers},
-                timeout=DEFAULT_REQUESTS_TIMEOUTS,
-            )
+        with self.concurrency.slot():
+            if not rest:
+                gitqueryJSON = json.dumps(
+                    {"query": gitquery, "variables": json.dumps(gitvars)}
+                )
+                fullResponse = self._session.post(
+                    "https://api.github.com/graphql",
+                    data=gitqueryJSON,
+                    headers=headers,
+                    timeout=DEFAULT_REQUESTS_TIMEOUTS,
+                )
+            else:
+                fullResponse = self._session.get(
+                    "https://api.github.com" + gitquery,
+                    headers=headers,
+                    timeout=DEFAULT_REQUESTS_TIMEOUTS,
+                )
         _vPrint(
             verbose,
             "\n%s\n%s"
@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import contextlib
+import logging
+import threading
+import time
+
+import github3
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTracker:
+    """
+    Tracks the GitHub API budget of a session from its response headers
+
+    Installed as a response hook, it reads the ``X-RateLimit-*`` headers that
+    GitHub sends with every response, so checking the budget takes no
+    requests of its own. The budget of a resource is only fetched from the
+    ``/rate_limit`` endpoint before the first response for it is seen.
+
+    See: https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+    """
+
+    def __init__(self):
+        # resource -> {"limit": ..., "remaining": ..., "reset": ...}
+        self.resources = {}
+        self._lock = threading.Lock()
+
+    def update(self, response, *args, **kwargs):
+        """
+        Response hook recording the budget reported by a response
+        """
+        headers = response.headers
+        try:
+            budget = {
+                "limit": int(headers["X-RateLimit-Limit"]),
+                "remaining": int(headers["X-RateLimit-Remaining"]),
+                "reset": int(headers["X-RateLimit-Reset"]),
+            }
+        except (KeyError, ValueError):
+            return response
+
+        resource = headers.get("X-RateLimit-Resource", "core")
+        with self._lock:
+            self.resources[resource] = budget
+        return response
+
+    def seed(self, rate_limit):
+        """
+        Records the budgets returned by the ``/rate_limit`` endpoint
+        """
+        with self._lock:
+            for resource, budget in rate_limit["resources"].items():
+                self.resources.setdefault(resource, budget)
+
+    def budget(self, resource="core"):
+        """
+        Returns the (remaining, reset) budget of a resource, or None if unknown
+        """
+        with self._lock:
+            budget = self.resources.get(resource)
+            if budget is None:
+                return None
+
+            if budget["reset"] <= time.time():
+                # The window has rolled over since the last response
+                return budget["limit"], None
+            return budget["remaining"], budget["reset"]
+
+    def wait(self, required, resource="core"):
+        """
+        Sleeps until the reset time if fewer than ``required`` requests remain
+        """
+        remaining, reset = self.budget(resource)
+        logger.debug("Rate Limit - %d %s requests remaining", remaining, resource)
+
+        if remaining > required or reset is None:
+            return
+
+        time_to_reset = max(reset - time.time(), 0) + 1
+        logger.warning("Rate Limit Depleted - Sleeping for %d seconds", time_to_reset)
+        time.sleep(time_to_reset)
+
+
+def secondary_limit_wait(status, headers, body):
+    """
+    Returns the seconds to back off for a secondary rate limit response
+
+    Returns None if the response did not hit a secondary rate limit. Running
+    out of the primary budget is left to RateLimitTracker.
+
+    See: https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api#about-secondary-rate-limits
+    """
+    if status not in (403, 429):
+        return None
+    if headers.get("X-RateLimit-Remaining") == "0":
+        return None
+    if (
+        status == 403
+        and "Retry-After" not in headers
+        and "secondary rate limit" not in body.lower()
+    ):
+        # A plain permission error
+        return None
+
+    try:
+        return int(headers["Retry-After"])
+    except (KeyError, ValueError):
+        # Wait at least a minute, as recommended by GitHub
+        return 60
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight, adapting the limit AIMD style
+
+    The limit grows by one for every ``limit`` healthy responses (additive
+    increase) and halves when a secondary rate limit is hit (multiplicative
+    decrease). A secondary rate limit also holds every new request until its
+    ``Retry-After`` time has passed.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.backoffs = 0
+
+        self._paused_until = 0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Waits for room under the limit, and holds it while the block runs
+        """
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.time()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self._condition.wait()
+            self.in_flight += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def backoff(self, wait):
+        with self._condition:
+            now = time.time()
+            # Requests that were already in flight when the limit was hit
+            # are likely to hit it too, only count it once per pause
+            if now >= self._paused_until:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.backoffs += 1
+                logger.warning(
+                    "Secondary Rate Limit - Sleeping for %d seconds, "
+                    "concurrency limit lowered to %d",
+                    wait,
+                    self.limit,
+                )
+            self._paused_until = max(self._paused_until, now + wait)
+
+    def __str__(self):
+        return "concurrency: limit=%d backoffs=%d" % (self.limit, self.backoffs)
+
+
+class ThrottledSession(github3.session.GitHubSession):
+    """
+    A github3.py session that adapts its concurrency to secondary rate limits
+
+    Requests hitting a secondary rate limit are retried (up to
+    ``max_retries`` times) once its ``Retry-After`` time has passed.
+    """
+
+    def __init__(self, max_retries=5, **timeouts):
+        super().__init__(**timeouts)
+        self.max_retries = max_retries
+        self.concurrency = AdaptiveConcurrency()
+
+    def request(self, *args, **kwargs):
+        for _ in range(self.max_retries):
+            with self.concurrency.slot():
+                response = super().request(*args, **kwargs)
+
+            wait = None
+            if response.status_code in (403, 429):
+                # Only rate limit responses need their body decoded
+                wait = secondary_limit_wait(
+                    response.status_code, response.headers, response.text
+                )
+            if wait is None:
+                self.concurrency.success()
+                return response
+            self.concurrency.backoff(wait)
+
+        with self.concurrency.slot():
+            return super().request(*args, **kwargs)
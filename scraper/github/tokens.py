@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import functools
+import logging
+import threading
+import time
+
+from requests.auth import AuthBase
+
+logger = logging.getLogger(__name__)
+
+
+def _resource(request):
+    """
+    Guesses the rate limit resource a request will be counted against
+    """
+    path = request.path_url.split("?")[0]
+    if path.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in path:
+        return "search"
+    return "core"
+
+
+class TokenPool(AuthBase):
+    """
+    Authenticates each request with the token that has the most API budget left
+
+    The remaining budget of every token is tracked per rate limit resource
+    from the ``X-RateLimit-*`` headers of the responses, so no extra
+    requests are needed. Tokens that have not been used yet are preferred.
+    Requests only wait when every token is exhausted, and then only until
+    the earliest of them resets.
+
+    See: https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+    """
+
+    def __init__(self, tokens):
+        if not tokens:
+            raise ValueError("TokenPool needs at least one token")
+
+        self.tokens = list(tokens)
+        # (token, resource) -> (remaining, reset)
+        self._budget = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(token):
+        return "...%s" % token[-4:]
+
+    def _remaining(self, token, resource, now):
+        remaining, reset = self._budget.get((token, resource), (None, 0))
+        if remaining is None or reset <= now:
+            return float("inf")
+        return remaining
+
+    def _acquire(self, resource):
+        while True:
+            with self._lock:
+                now = time.time()
+                token = max(
+                    self.tokens, key=lambda t: self._remaining(t, resource, now)
+                )
+                if self._remaining(token, resource, now) > 0:
+                    return token
+                reset = min(self._budget[(t, resource)][1] for t in self.tokens)
+
+            wait = max(reset - now, 0) + 1
+            logger.warning(
+                "Rate Limit Depleted for all %d tokens - Sleeping for %d seconds",
+                len(self.tokens),
+                wait,
+            )
+            time.sleep(wait)
+
+    def _update(self, token, response, *args, **kwargs):
+        headers = response.headers
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = int(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return response
+
+        resource = headers.get("X-RateLimit-Resource", _resource(response.request))
+        with self._lock:
+            self._budget[(token, resource)] = (remaining, reset)
+
+        logger.debug(
+            "Rate Limit - token %s: %d %s requests remaining",
+            self._name(token),
+            remaining,
+            resource,
+        )
+        if remaining == 0:
+            logger.info(
+                "Rate Limit Depleted for token %s (%s) - %s",
+                self._name(token),
+                resource,
+                self,
+            )
+        return response
+
+    def __call__(self, request):
+        token = self._acquire(_resource(request))
+        request.headers["Authorization"] = "token %s" % token
+        request.register_hook("response", functools.partial(self._update, token))
+        return request
+
+    def __str__(self):
+        with self._lock:
+            budgets = sorted(
+                "%s %s=%d" % (self._name(token), resource, remaining)
+                for (token, resource), (remaining, _) in self._budget.items()
+            )
+        return "tokens: %s" % (", ".join(budgets) or "unused")
@@ -1,56 +1,154 @@
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# (name, GitHub license key, other names it is known by), names from:
+# https://api.github.com/licenses
+_LICENSES = (
+    (
+        "AGPL-3.0",
+        "agpl-3.0",
+        (
+            "GNU Affero General Public License v3.0",
+            "AGPL-3.0-only",
+            "AGPL-3.0-or-later",
+            "AGPLv3",
+        ),
+    ),
+    (
+        "Apache-2.0",
+        "apache-2.0",
+        (
+            "Apache License 2.0",
+            "Apache License, Version 2.0",
+            "Apache 2.0",
+            "Apache 2",
+            "Apache2",
+        ),
+    ),
+    (
+        "BSD-2-Clause",
+        "bsd-2-clause",
+        (
+            'BSD 2-clause "Simplified" License',
+            "BSD 2-Clause License",
+            "Simplified BSD License",
+            "BSD-2",
+        ),
+    ),
+    (
+        "BSD-3-Clause",
+        "bsd-3-clause",
+        (
+            'BSD 3-clause "New" or "Revised" License',
+            "BSD 3-Clause License",
+            "New BSD License",
+            "BSD-3",
+        ),
+    ),
+    ("BSD-3-Clause-Clear", "bsd-3-clause-clear", ("BSD 3-Clause Clear License",)),
+    ("BSD-4-Clause", "bsd-4-clause", ('BSD 4-Clause "Original" or "Old" License',)),
+    ("BSL-1.0", "bsl-1.0", ("Boost Software License 1.0",)),
+    ("CC0-1.0", "cc0-1.0", ("Creative Commons Zero v1.0 Universal",)),
+    ("CC-BY-4.0", "cc-by-4.0", ("Creative Commons Attribution 4.0 International",)),
+    ("EPL-1.0", "epl-1.0", ("Eclipse Public License 1.0",)),
+    ("EPL-2.0", "epl-2.0", ("Eclipse Public License 2.0",)),
+    (
+        "GPL-2.0",
+        "gpl-2.0",
+        (
+            "GNU General Public License v2.0",
+            "GPL-2.0-only",
+            "GPL-2.0-or-later",
+            "GPL-2.0+",
+            "GPLv2",
+            "GPL v2",
+        ),
+    ),
+    ("GPL-2.1", "gpl-2.1", ("GNU General Public License v2.1",)),
+    (
+        "GPL-3.0",
+        "gpl-3.0",
+        (
+            "GNU General Public License v3.0",
+            "GPL-3.0-only",
+            "GPL-3.0-or-later",
+            "GPL-3.0+",
+            "GPLv3",
+            "GPL v3",
+        ),
+    ),
+    ("ISC", "isc", ("ISC License",)),
+    (
+        "LGPL-2.1",
+        "lgpl-2.1",
+        (
+            "GNU Lesser General Public License v2.1",
+            "LGPL-2.1-only",
+            "LGPL-2.1-or-later",
+            "LGPL-2.1+",
+            "LGPLv2.1",
+        ),
+    ),
+    (
+        "LGPL-3.0",
+        "lgpl-3.0",
+        (
+            "GNU Lesser General Public License v3.0",
+            "LGPL-3.0-only",
+            "LGPL-3.0-or-later",
+            "LGPL-3.0+",
+            "LGPLv3",
+        ),
+    ),
+    ("MIT", "mit", ("MIT License",)),
+    ("MIT-0", "mit-0", ("MIT No Attribution",)),
+    ("MPL-2.0", "mpl-2.0", ("Mozilla Public License 2.0",)),
+    ("OSL-3.0", "osl-3.0", ("Open Software License 3.0",)),
+    ("Unlicense", "unlicense", ("The Unlicense",)),
+    ("Zlib", "zlib", ("zlib License",)),
+)
+
+
+def _normalize(license_name):
+    """
+    Returns a license name reduced to lowercase words, for lookups
+
+    Hyphens separate words like spaces do, so "GPL-3.0" and "GPL 3.0" match.
+    """
+    return " ".join(re.findall(r"[a-z0-9.+]+", license_name.lower()))
+
+
+def _license_index():
+    """
+    Returns a dictionary of every known license name, alias and id
+    """
+    index = {}
+    for name, key, aliases in _LICENSES:
+        obj = {"URL": "https://api.github.com/licenses/%s" % key, "name": name}
+        for alias in (name, key) + aliases:
+            normalized = _normalize(alias)
+            if index.get(normalized, obj) is not obj:
+                raise ValueError("Ambiguous license name: %s" % alias)
+            index[normalized] = obj
+    return index
+
+
+_LICENSE_INDEX = _license_index()
+
 
 def _license_obj(license_name):
     """
     A helper function to look up license object information
 
-    Use names from: https://api.github.com/licenses
+    Licenses are matched by SPDX id, GitHub key or name, ignoring case,
+    punctuation and spacing. An unknown license is passed on by name.
     """
-    obj = None
-
-    if license_name in ("MIT", "MIT License"):
-        obj = {"URL": "https://api.github.com/licenses/mit", "name": "MIT"}
-    elif license_name in ('BSD 2-clause "Simplified" License'):
-        obj = {
-            "URL": "https://api.github.com/licenses/bsd-2-clause",
-            "name": "BSD-2-Clause",
-        }
-    elif license_name in ('BSD 3-clause "New" or "Revised" License'):
-        obj = {
-            "URL": "https://api.github.com/licenses/bsd-3-clause",
-            "name": "BSD-3-Clause",
-        }
-    elif license_name in ("Apache License 2.0"):
-        obj = {
-            "URL": "https://api.github.com/licenses/apache-2.0",
-            "name": "Apache-2.0",
-        }
-    elif license_name in ("GNU General Public License v2.1"):
-        obj = {"URL": "https://api.github.com/licenses/gpl-2.1", "name": "GPL-2.1"}
-    elif license_name in ("GNU General Public License v2.0"):
-        obj = {"URL": "https://api.github.com/licenses/gpl-2.0", "name": "GPL-2.0"}
-    elif license_name in ("GNU Lesser General Public License v2.1"):
-        obj = {"URL": "https://api.github.com/licenses/lgpl-2.1", "name": "LGPL-2.1"}
-    elif license_name in ("GNU General Public License v3.0"):
-        obj = {"URL": "https://api.github.com/licenses/gpl-3.0", "name": "GPL-3.0"}
-    elif license_name in ("GNU Lesser General Public License v3.0"):
-        obj = {"URL": "https://api.github.com/licenses/lgpl-3.0", "name": "LGPL-3.0"}
-    elif license_name in ("Eclipse Public License 1.0"):
-        obj = {"URL": "https://api.github.com/licenses/epl-1.0", "name": "EPL-1.0"}
-    elif license_name in ("Mozilla Public License 2.0"):
-        obj = {"URL": "https://api.github.com/licenses/mpl-2.0", "name": "MPL-2.0"}
-    elif license_name in ("The Unlicense"):
-        obj = {"URL": "https://api.github.com/licenses/unlicense", "name": "Unlicense"}
-    elif license_name in ("GNU Affero General Public License v3.0"):
-        obj = {"URL": "https://api.github.com/licenses/agpl-3.0", "name": "AGPL-3.0"}
-    elif license_name in ("Eclipse Public License 2.0"):
-        obj = {"URL": "https://api.github.com/licenses/epl-2.0", "name": "EPL-2.0"}
+    obj = _LICENSE_INDEX.get(_normalize(license_name))
 
     if obj is None:
         logger.warning("I don't understand the license: %s", license_name)
-        raise ValueError("Aborting!")
+        return {"name": license_name}
 
-    return obj
+    return dict(obj)
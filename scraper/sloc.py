@@ -0,0 +1,562 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+A built-in counter of source lines of code, as an alternative to cloc
+
+Files are classified by language from their name, and each line is counted
+as blank, comment or code following the same rules as cloc: a line holding
+any code counts as code, a line holding only comments counts as a comment,
+and duplicate files are only counted once. The results use the same layout
+as ``cloc --json``, so ``result["SUM"]["code"]`` can be used in its place.
+
+Reference:
+- cloc: https://github.com/AlDanial/cloc
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import tarfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# A "#!" first line counts as code in the script languages, and everything
+# from a line starting with a ``trailer`` marker on is a comment (as with cloc)
+Language = namedtuple(
+    "Language", ["name", "line", "block", "column1", "shebang", "trailer"]
+)
+Language.__new__.__defaults__ = ((), (), (), False, ())
+
+_POD = tuple(
+    (start, "=cut")
+    for start in ("=pod", "=head", "=item", "=over", "=begin", "=for", "=encoding")
+)
+
+_C_BLOCK = (("/*", "*/"),)
+
+_C = ("//",)
+
+_HASH = ("#",)
+
+_DOCSTRINGS = (('"""', '"""'), ("'''", "'''"))
+
+_LANGUAGES = {
+    "ada": Language("Ada", ("--",)),
+    "asm": Language("Assembly", (";", "//", "#"), _C_BLOCK),
+    "awk": Language("awk", _HASH, shebang=True),
+    "bash": Language("Bourne Again Shell", _HASH, shebang=True),
+    "bat": Language("DOS Batch", ("REM ", "rem ", "::")),
+    "c": Language("C", _C, _C_BLOCK),
+    "chpl": Language("Chapel", _C, _C_BLOCK),
+    "clj": Language("Clojure", (";",)),
+    "cmake": Language("CMake", _HASH, (("#[[", "]]"),)),
+    "cpp": Language("C++", _C, _C_BLOCK),
+    "cs": Language("C#", _C, _C_BLOCK),
+    "csh": Language("C Shell", _HASH, shebang=True),
+    "css": Language("CSS", (), _C_BLOCK),
+    "cu": Language("CUDA", _C, _C_BLOCK),
+    "d": Language("D", _C, _C_BLOCK + (("/+", "+/"),)),
+    "dart": Language("Dart", _C, _C_BLOCK),
+    "dockerfile": Language("Dockerfile", _HASH),
+    "el": Language("Lisp", (";",)),
+    "erl": Language("Erlang", ("%",)),
+    "ex": Language("Elixir", _HASH),
+    "f77": Language("Fortran 77", ("!",), (), ("C", "c", "*", "!")),
+    "f90": Language("Fortran 90", ("!",)),
+    "f95": Language("Fortran 95", ("!",)),
+    "fish": Language("Fish Shell", _HASH),
+    "go": Language("Go", _C, _C_BLOCK),
+    "groovy": Language("Groovy", _C, _C_BLOCK),
+    "h": Language("C/C++ Header", _C, _C_BLOCK),
+    "hs": Language("Haskell", ("--",), (("{-", "-}"),)),
+    "ini": Language("INI", (";",)),
+    "html": Language("HTML", (), (("<!--", "-->"),)),
+    "java": Language("Java", _C, _C_BLOCK),
+    "jl": Language("Julia", _HASH, (("#=", "=#"),)),
+    "js": Language("JavaScript", _C, _C_BLOCK),
+    "json": Language("JSON"),
+    "kt": Language("Kotlin", _C, _C_BLOCK),
+    "less": Language("LESS", _C, _C_BLOCK),
+    "lisp": Language("Lisp", (";",)),
+    "lua": Language("Lua", ("--",), (("--[[", "]]"),)),
+    "make": Language("make", _HASH, shebang=True),
+    "md": Language("Markdown", (), (("<!--", "-->"),)),
+    "ml": Language("OCaml", (), (("(*", "*)"),)),
+    "mm": Language("Objective-C++", _C, _C_BLOCK),
+    "nim": Language("Nim", _HASH, (("#[", "]#"),)),
+    "php": Language("PHP", _C + _HASH, _C_BLOCK, shebang=True),
+    "pl": Language("Perl", _HASH, _POD, shebang=True, trailer=("__END__", "__DATA__")),
+    "proto": Language("Protocol Buffers", _C, _C_BLOCK),
+    "ps1": Language("PowerShell", _HASH, (("<#", "#>"),)),
+    "py": Language("Python", _HASH, _DOCSTRINGS, shebang=True),
+    "pyx": Language("Cython", _HASH, _DOCSTRINGS),
+    "r": Language("R", _HASH),
+    "rb": Language("Ruby", _HASH, (("=begin", "=end"),), shebang=True),
+    "rs": Language("Rust", _C, _C_BLOCK),
+    "rst": Language("reStructuredText", ()),
+    "scala": Language("Scala", _C, _C_BLOCK),
+    "scss": Language("SCSS", _C, _C_BLOCK),
+    "sh": Language("Bourne Shell", _HASH, shebang=True),
+    "sql": Language("SQL", ("--",), _C_BLOCK),
+    "sv": Language("Verilog-SystemVerilog", _C, _C_BLOCK),
+    "swift": Language("Swift", _C, _C_BLOCK),
+    "tcl": Language("Tcl/Tk", _HASH, shebang=True),
+    "tex": Language("TeX", ("%",)),
+    "toml": Language("TOML", _HASH),
+    "ts": Language("TypeScript", _C, _C_BLOCK),
+    "txt": Language("Text"),
+    "vb": Language("Visual Basic", ("'",)),
+    "vim": Language("vim script", ('"',)),
+    "vue": Language("Vuejs Component", _C, _C_BLOCK + (("<!--", "-->"),)),
+    "xml": Language("XML", (), (("<!--", "-->"),)),
+    "yaml": Language("YAML", _HASH),
+    "zsh": Language("zsh", _HASH, shebang=True),
+}
+
+# File extensions (and whole file names) recognized, and their language
+_EXTENSIONS = {
+    "adb": "ada",
+    "ads": "ada",
+    "asm": "asm",
+    "s": "asm",
+    "awk": "awk",
+    "bash": "bash",
+    "bat": "bat",
+    "cmd": "bat",
+    "c": "c",
+    "chpl": "chpl",
+    "clj": "clj",
+    "cljs": "clj",
+    "cmake": "cmake",
+    "c++": "cpp",
+    "cc": "cpp",
+    "cpp": "cpp",
+    "cxx": "cpp",
+    "C": "cpp",
+    "cs": "cs",
+    "csh": "csh",
+    "css": "css",
+    "cu": "cu",
+    "cuh": "cu",
+    "d": "d",
+    "dart": "dart",
+    "el": "el",
+    "erl": "erl",
+    "ex": "ex",
+    "exs": "ex",
+    "f": "f77",
+    "for": "f77",
+    "f77": "f77",
+    "f90": "f90",
+    "f95": "f95",
+    "F": "f77",
+    "F90": "f90",
+    "fish": "fish",
+    "go": "go",
+    "groovy": "groovy",
+    "gradle": "groovy",
+    "h": "h",
+    "H": "h",
+    "hh": "h",
+    "hpp": "h",
+    "hxx": "h",
+    "hs": "hs",
+    "ini": "ini",
+    "htm": "html",
+    "html": "html",
+    "java": "java",
+    "jl": "jl",
+    "cjs": "js",
+    "js": "js",
+    "jsx": "js",
+    "mjs": "js",
+    "json": "json",
+    "jsonl": "json",
+    "kt": "kt",
+    "kts": "kt",
+    "less": "less",
+    "lisp": "lisp",
+    "lua": "lua",
+    "mk": "make",
+    "md": "md",
+    "ronn": "md",
+    "markdown": "md",
+    "ml": "ml",
+    "mli": "ml",
+    "mm": "mm",
+    "nim": "nim",
+    "php": "php",
+    "pl": "pl",
+    "pm": "pl",
+    "proto": "proto",
+    "ps1": "ps1",
+    "py": "py",
+    "pyi": "py",
+    "pyw": "py",
+    "pxd": "pyx",
+    "pxi": "pyx",
+    "pyx": "pyx",
+    "r": "r",
+    "R": "r",
+    "rb": "rb",
+    "rs": "rs",
+    "rst": "rst",
+    "scala": "scala",
+    "scss": "scss",
+    "sh": "sh",
+    "sql": "sql",
+    "sv": "sv",
+    "v": "sv",
+    "swift": "swift",
+    "tcl": "tcl",
+    "tex": "tex",
+    "toml": "toml",
+    "ts": "ts",
+    "tsx": "ts",
+    "txt": "txt",
+    "vb": "vb",
+    "vim": "vim",
+    "vue": "vue",
+    "xml": "xml",
+    "xsd": "xml",
+    "yaml": "yaml",
+    "yml": "yaml",
+    "zsh": "zsh",
+}
+
+# Interpreters named on the "#!" line of scripts without a file extension
+_INTERPRETERS = {
+    "awk": "awk",
+    "bash": "bash",
+    "csh": "csh",
+    "fish": "fish",
+    "gawk": "awk",
+    "make": "make",
+    "node": "js",
+    "perl": "pl",
+    "php": "php",
+    "python": "py",
+    "ruby": "rb",
+    "sh": "sh",
+    "tclsh": "tcl",
+    "tcsh": "csh",
+    "wish": "tcl",
+    "zsh": "zsh",
+}
+
+_FILENAMES = {
+    "CMakeLists.txt": "cmake",
+    "Dockerfile": "dockerfile",
+    "GNUmakefile": "make",
+    "Makefile": "make",
+    "makefile": "make",
+}
+
+# Directories skipped while walking a source tree, as with cloc
+_EXCLUDED_DIRS = {".bzr", ".cvs", ".git", ".hg", ".svn", "CVS"}
+
+# String literals, removed before looking for block comments
+_STRINGS = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'')
+
+
+def language(path, data=None):
+    """
+    Returns the Language of a file, based on its name, or None
+
+    Files without an extension are recognized by the interpreter on their
+    "#!" line instead, given their contents as ``data``.
+    """
+    name = os.path.basename(path)
+    key = _FILENAMES.get(name)
+    _, ext = os.path.splitext(name)
+    if key is None:
+        key = _EXTENSIONS.get(ext[1:]) or _EXTENSIONS.get(ext[1:].lower())
+    if key is None and not ext and data is not None:
+        key = _script_language(data)
+    if key is None:
+        return None
+    return _LANGUAGES[key]
+
+
+def _script_language(data):
+    """
+    Returns the language key of a script from its "#!" line, or None
+    """
+    if not data.startswith(b"#!"):
+        return None
+    words = data[2:].split(b"\n", 1)[0].decode("utf-8", "replace").split()
+    if words and os.path.basename(words[0]) == "env":
+        words = [word for word in words[1:] if not word.startswith("-")]
+    if not words:
+        return None
+    # e.g. python3.11
+    interpreter = os.path.basename(words[0]).rstrip("0123456789.")
+    return _INTERPRETERS.get(interpreter)
+
+
+def _maybe_source(name):
+    """
+    Returns whether a file may be source code, before reading it
+    """
+    name = os.path.basename(name)
+    return language(name) is not None or "." not in name
+
+
+def count_lines(lang, text):
+    """
+    Returns the (blank, comment, code) line counts of ``text`` in ``lang``
+    """
+    blank = comment = code = 0
+
+    lines = text.split("\n")
+    if lines and not lines[-1]:
+        lines.pop()
+
+    # The closing delimiter of the block comment being read, if any
+    end = None
+    trailing = False
+
+    for number, raw in enumerate(lines):
+        line = raw.strip()
+        if not line:
+            blank += 1
+            continue
+
+        if end is None and lang.trailer and raw.startswith(lang.trailer):
+            trailing = True
+        if trailing:
+            comment += 1
+            continue
+
+        if number == 0 and lang.shebang and line.startswith("#!"):
+            code += 1
+            continue
+
+        if end is None and raw[:1] in lang.column1:
+            comment += 1
+            continue
+
+        has_code = False
+        while line:
+            if end is not None:
+                index = line.find(end)
+                if index < 0:
+                    break
+                index += len(end)
+                line = line[index:].lstrip()
+                end = None
+                continue
+
+            for start, stop in lang.block:
+                if line.startswith(start):
+                    line = line.replace(start, "", 1)
+                    end = stop
+                    break
+            else:
+                if line.startswith(lang.line):
+                    break
+
+                has_code = True
+
+                # Look for a block comment starting after the code, unless a
+                # line comment comes first
+                line = _STRINGS.sub(lambda match: match.group(0)[0] * 2, line)
+                starts = [
+                    (line.find(start), start, stop)
+                    for start, stop in lang.block
+                    if start in line
+                ]
+                if not starts:
+                    break
+
+                index, start, stop = min(starts)
+                if any(0 <= line.find(marker) < index for marker in lang.line):
+                    break
+
+                index += len(start)
+                line = line[index:]
+                end = stop
+
+        if has_code:
+            code += 1
+        else:
+            comment += 1
+
+    return blank, comment, code
+
+
+def count_blob(name, data):
+    """
+    Counts the lines of a file, given its name and contents
+
+    Returns a (language name, blank, comment, code, digest) tuple, or None if
+    the file is not recognized as source code.
+    """
+    lang = language(name, data)
+    if lang is None or b"\0" in data[:8192]:
+        return None
+
+    text = data.decode("utf-8", errors="replace").replace("\r", "")
+    blank, comment, code = count_lines(lang, text)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    return lang.name, blank, comment, code, digest
+
+
+def count_file(path):
+    """
+    Counts the lines of a single file, see count_blob
+    """
+    if not _maybe_source(path):
+        return None
+
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+    except OSError as exc:
+        logger.debug("Unable to read: path=%s error=%s", path, exc)
+        return None
+
+    return count_blob(path, data)
+
+
+def _count_blob(args):
+    return count_blob(*args)
+
+
+def source_files(path):
+    """
+    Yields the paths of the files under a directory that may be source code
+    """
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in _EXCLUDED_DIRS)
+        for name in sorted(files):
+            filepath = os.path.join(root, name)
+            if _maybe_source(name) and not os.path.islink(filepath):
+                yield filepath
+
+
+def archive_blobs(fileobj):
+    """
+    Yields (name, data) pairs for the files in a tar stream that may be source
+
+    The stream is read sequentially, so it may be a pipe such as the output
+    of ``git archive``.
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|") as archive:
+        for member in archive:
+            if not member.isfile() or not _maybe_source(member.name):
+                continue
+            if _EXCLUDED_DIRS.intersection(member.name.split("/")[:-1]):
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+def _count_chunk(func, items):
+    return [func(item) for item in items]
+
+
+def summarize(counts, elapsed=0.0):
+    """
+    Combines per-file counts into a dict shaped like ``cloc --json`` output
+
+    Files with identical contents are only counted once.
+    """
+    result = {}
+    total = {"blank": 0, "comment": 0, "code": 0, "nFiles": 0}
+    seen = set()
+
+    for count in counts:
+        if count is None:
+            continue
+
+        name, blank, comment, code, digest = count
+        if digest in seen:
+            continue
+        seen.add(digest)
+
+        language_total = result.setdefault(
+            name, {"nFiles": 0, "blank": 0, "comment": 0, "code": 0}
+        )
+        for stats in (language_total, total):
+            stats["nFiles"] += 1
+            stats["blank"] += blank
+            stats["comment"] += comment
+            stats["code"] += code
+
+    result["header"] = {
+        "elapsed_seconds": elapsed,
+        "n_files": total["nFiles"],
+        "n_lines": total["blank"] + total["comment"] + total["code"],
+    }
+    result["SUM"] = total
+
+    return result
+
+
+class Counter:
+    """
+    Counts lines of code, spreading files across a pool of processes
+
+    A single Counter may be shared by several threads. With ``jobs=1``,
+    files are counted in the calling thread instead.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs or os.cpu_count()
+        self._executor = None
+        if self.jobs > 1:
+            # Workers are started on first use, typically from a thread of a
+            # pool, and forking a process that runs threads can deadlock
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            else:
+                context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.jobs, mp_context=context
+            )
+
+    def _map(self, func, items):
+        if self._executor is None:
+            yield from map(func, items)
+            return
+
+        # Unlike Executor.map, only keep a few chunks in flight so that
+        # streamed file contents are not all read into memory at once
+        items = iter(items)
+        window = deque()
+        while True:
+            chunk = list(itertools.islice(items, 32))
+            if chunk:
+                window.append(self._executor.submit(_count_chunk, func, chunk))
+            if not window:
+                return
+            if not chunk or len(window) >= 2 * self.jobs:
+                yield from window.popleft().result()
+
+    def count_directory(self, path):
+        """
+        Returns cloc style counts for the source files under a directory
+        """
+        start = time.time()
+        counts = self._map(count_file, source_files(path))
+        return summarize(counts, time.time() - start)
+
+    def count_blobs(self, blobs):
+        """
+        Returns cloc style counts for an iterable of (name, data) pairs
+        """
+        start = time.time()
+        counts = self._map(_count_blob, blobs)
+        return summarize(counts, time.time() - start)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -1,10 +1,17 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 import functools
 import json
 import logging
 import logging.config
 import os
 from subprocess import PIPE, Popen  # nosec
+import tarfile
 import tempfile
+import threading
+
+from scraper import sloc
 
 logger = logging.getLogger(__name__)
 
@@ -73,10 +80,154 @@ def configure_logging(verbose=False):
     logging.config.dictConfig(DEFAULT_LOGGING)
 
 
-def git_repo_to_sloc(url):
+def ordered_map(func, iterable, jobs=1):
+    """
+    Yields ``func(item)`` for every item of ``iterable``, in input order
+
+    When ``jobs`` is greater than one, the calls are spread across a pool of
+    ``jobs`` worker threads. Only a bounded window of items is submitted ahead
+    of the one currently being yielded, so ``iterable`` is consumed lazily and
+    memory use does not grow with the number of items.
+
+    Exceptions raised by ``func`` are re-raised when the corresponding result
+    is reached, exactly as they would be in a serial loop.
+    """
+    if jobs is None or jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def git_head_sha(url):
+    """
+    Returns the commit SHA of HEAD for a Git repository URL, without cloning
+
+    Returns None if the remote could not be queried.
+    """
+    cmd = ["git", "ls-remote", url, "HEAD"]
+    out, _ = execute(cmd)
+
+    for line in out.splitlines():
+        sha, _, ref = line.partition("\t")
+        if ref == "HEAD":
+            return sha
+
+    logger.debug("Unable to determine HEAD: url=%s", url)
+    return None
+
+
+class ScratchSpace:
+    """
+    A scratch directory for temporary clones, with a cap on total disk usage
+
+    Each clone reserves its expected size (or ``default_mb`` if unknown)
+    before it starts, and waits until the reservation fits under
+    ``limit_mb`` alongside the clones already in progress. A clone larger
+    than the limit on its own still runs, once nothing else is in progress.
+    Without a limit, reservations never wait.
+    """
+
+    def __init__(self, path=None, limit_mb=None, default_mb=None):
+        self.path = path
+        self.limit = limit_mb * 2**20 if limit_mb else None
+        self.default = default_mb * 2**20 if default_mb else 0
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, size=None):
+        """
+        Context manager holding a reservation of ``size`` bytes
+
+        Yields the scratch directory path to clone under (None for the
+        system default temporary directory).
+        """
+        if self.limit is None:
+            yield self.path
+            return
+
+        if size is None:
+            size = self.default
+
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.in_use == 0 or self.in_use + size <= self.limit
+            )
+            self.in_use += size
+
+        try:
+            yield self.path
+        finally:
+            with self._cond:
+                self.in_use -= size
+                self._cond.notify_all()
+
+
+def _count_archive(counter, git_dir):
+    """
+    Counts the files at HEAD of a (bare) repository with ``counter``
+
+    The output of ``git archive`` is streamed straight into the counter, so
+    no working tree is ever written to disk. Returns None as the counts if
+    there was nothing to archive.
+    """
+    cmd = ["git", "archive", "--format=tar", "HEAD"]
+    logger.debug("Forking command: %s", cmd)
+
+    # stderr goes to a file, so that a chatty command can't block on a full
+    # pipe while its stdout is being read
+    with tempfile.TemporaryFile() as stderr, Popen(  # nosec
+        cmd, cwd=git_dir, stdout=PIPE, stderr=stderr
+    ) as process:
+        try:
+            counts = counter.count_blobs(sloc.archive_blobs(process.stdout))
+        except tarfile.ReadError:
+            # e.g. an empty repository, which has no HEAD to archive
+            logger.debug("No archive to count: git_dir=%s", git_dir)
+            counts = None
+        process.stdout.close()
+        process.wait()
+        stderr.seek(0)
+        err = stderr.read().decode("utf-8")
+
+    if process.returncode:
+        logging.error(
+            "Error Executing: command=%s, returncode=%d",
+            " ".join(cmd),
+            process.returncode,
+        )
+
+    return counts, err
+
+
+def git_repo_to_sloc(
+    url, cache=None, scratch=None, size=None, counter=None, mode="checkout"
+):
     """
     Given a Git repository URL, returns number of lines of code based on cloc
 
+    If a ``cache`` (a scraper.cache.DiskCache) is given, results are stored
+    keyed by the repository URL and HEAD commit SHA, so that repositories
+    without new commits are neither cloned nor counted again.
+
+    If a ``scratch`` (a ScratchSpace) is given, the repository is cloned
+    under its directory once ``size`` bytes can be reserved.
+
+    If a ``counter`` (a scraper.sloc.Counter) is given, lines are counted with
+    it rather than by running the cloc executable. With a counter, ``mode``
+    may also be set to "archive" to make a bare clone and stream its files
+    from ``git archive`` into the counter instead of checking them out.
+
     Reference:
     - cloc: https://github.com/AlDanial/cloc
     - https://www.omg.org/spec/AFP/
@@ -126,28 +277,62 @@ def git_repo_to_sloc(url):
         }
     """
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
+    method = "cloc" if counter is None else "builtin"
+    if mode not in ("checkout", "archive"):
+        raise ValueError("Unknown clone mode: %s" % mode)
+    if mode == "archive" and counter is None:
+        raise ValueError("Clone mode 'archive' requires the builtin SLOC counter")
+
+    if cache is not None:
+        head = git_head_sha(url)
+        sloc = cache.get(url, [head, method]) if head else None
+        if sloc is not None:
+            logger.debug("SLOC (cached): url=%s, head=%s, sloc=%d", url, head, sloc)
+            return sloc
+
+    if scratch is None:
+        scratch = ScratchSpace()
+
+    with scratch.reserve(size) as scratch_dir, tempfile.TemporaryDirectory(
+        dir=scratch_dir
+    ) as tmp_dir:
         logger.debug("Cloning: url=%s tmp_dir=%s", url, tmp_dir)
 
         tmp_clone = os.path.join(tmp_dir, "clone-dir")
 
-        cmd = ["git", "clone", "--depth=1", url, tmp_clone]
+        if mode == "archive":
+            cmd = ["git", "clone", "--bare", "--depth=1", url, tmp_clone]
+        else:
+            cmd = ["git", "clone", "--depth=1", url, tmp_clone]
         execute(cmd)
 
-        cmd = ["cloc", "--json", tmp_clone]
-        out, err = execute(cmd)
+        cloc_json = None
+        if mode == "archive":
+            cloc_json, err = _count_archive(counter, tmp_clone)
+        elif counter is None:
+            cmd = ["cloc", "--json", tmp_clone]
+            out, err = execute(cmd)
+            try:
+                cloc_json = json.loads(out)
+            except json.decoder.JSONDecodeError:
+                logger.error("Error Decoding: url=%s, out=%s", url, out)
+        else:
+            cloc_json, err = counter.count_directory(tmp_clone), ""
 
         if err:
             logger.warning(
                 "Error encountered while analyzing: url=%s stderr=%s", url, err
             )
 
+        head = None
+        sloc = 0
         try:
-            cloc_json = json.loads(out)
-            sloc = cloc_json["SUM"]["code"]
-        except json.decoder.JSONDecodeError:
-            logger.error("Error Decoding: url=%s, out=%s", url, out)
-            sloc = 0
+            if cloc_json is not None:
+                sloc = cloc_json["SUM"]["code"]
+                if cache is not None:
+                    # Key on the commit that was actually counted
+                    out, _ = execute(["git", "rev-parse", "HEAD"], cwd=tmp_clone)
+                    head = out.strip()
         except KeyError:
             logging.error(
                 "Missing LOC information (Is the repository empty?): url=%s, json=%s",
@@ -156,6 +341,9 @@ def git_repo_to_sloc(url):
             )
             sloc = 0
 
+    if head:
+        cache.set(url, sloc, [head, method])
+
     logger.debug("SLOC: url=%s, sloc=%d", url, sloc)
 
     return sloc
@@ -236,8 +424,22 @@ def compute_labor_hours(sloc, month_hours="cocomo_book"):
     return labor_hours
 
 
-def labor_hours_from_url(url):
-    sum_sloc = git_repo_to_sloc(url)
+def labor_hours_from_url(
+    url,
+    sloc_cache=None,
+    scratch=None,
+    size=None,
+    sloc_counter=None,
+    clone_mode="checkout",
+):
+    sum_sloc = git_repo_to_sloc(
+        url,
+        cache=sloc_cache,
+        scratch=scratch,
+        size=size,
+        counter=sloc_counter,
+        mode=clone_mode,
+    )
     logger.info("SLOC: %d", sum_sloc)
 
     labor_hours = compute_labor_hours(sum_sloc)
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+from timeit import default_timer as timer
+
+from scraper.sloc import Counter
+from scraper.util import compute_labor_hours
+
+# Small sample trees committed next to this script, compared when no paths are given
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sloc_fixtures")
+
+
+def fixture_paths():
+    """
+    Returns the paths of the committed sample trees
+    """
+    return [
+        os.path.join(FIXTURES_DIR, name) for name in sorted(os.listdir(FIXTURES_DIR))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the builtin SLOC counter against cloc on local repositories"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Paths to locally cloned repositories (defaults to the sample trees in sloc_fixtures)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="Processes used by the builtin counter"
+    )
+    args = parser.parse_args()
+
+    has_cloc = shutil.which("cloc") is not None
+    if not has_cloc:
+        print("cloc not found, only timing the builtin counter")
+
+    counter = Counter(args.jobs)
+
+    print(
+        "%-40s %10s %10s %7s %8s %9s %10s"
+        % ("repository", "cloc", "builtin", "diff", "cloc s", "builtin s", "hours diff")
+    )
+
+    for path in args.paths or fixture_paths():
+        start = timer()
+        builtin_sloc = counter.count_directory(path)["SUM"]["code"]
+        builtin_time = timer() - start
+
+        cloc_sloc = diff = cloc_time = hours_diff = "n/a"
+        if has_cloc:
+            start = timer()
+            out = subprocess.run(
+                ["cloc", "--json", path], stdout=subprocess.PIPE, check=True
+            ).stdout
+            cloc_time = "%.2f" % (timer() - start)
+            cloc_code = json.loads(out)["SUM"]["code"] if out.strip() else 0
+
+            cloc_sloc = str(cloc_code)
+            if cloc_code:
+                diff = "%.1f%%" % (100.0 * (builtin_sloc - cloc_code) / cloc_code)
+            hours_diff = "%.0f" % (
+                compute_labor_hours(builtin_sloc) - compute_labor_hours(cloc_code)
+            )
+
+        print(
+            "%-40s %10s %10d %7s %8s %9.2f %10s"
+            % (
+                os.path.basename(path.rstrip("/")),
+                cloc_sloc,
+                builtin_sloc,
+                diff,
+                cloc_time,
+                builtin_time,
+                hours_diff,
+            )
+        )
+
+    counter.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#include <stdlib.h>
+#include <string.h>
+
+#include "buffer.h"
+
+// Grows the buffer to hold at least need bytes
+static int grow(struct buffer *buf, size_t need)
+{
+    size_t cap = buf->cap ? buf->cap : 16;
+    char *data;
+
+    while (cap < need)
+        cap *= 2;  /* doubling
+                      keeps appends amortized */
+    data = realloc(buf->data, cap);
+    if (!data)
+        return -1;
+    buf->data = data;
+    buf->cap = cap;
+    return 0;
+}
+
+int buffer_append(struct buffer *buf, const char *bytes, size_t len)
+{
+    if (buf->len + len > buf->cap && grow(buf, buf->len + len))
+        return -1;
+    memcpy(buf->data + buf->len, bytes, len);
+    buf->len += len;
+    return 0;
+}
+
+/* Releases the storage */ void buffer_free(struct buffer *buf)
+{
+    free(buf->data);
+    buf->data = NULL;
+    buf->len = buf->cap = 0;
+}
@@ -0,0 +1,18 @@
+/*
+ * Growable byte buffer.
+ */
+#ifndef BUFFER_H
+#define BUFFER_H
+
+#include <stddef.h>
+
+struct buffer {
+    char *data;  /* owned */
+    size_t len;
+    size_t cap;
+};
+
+int buffer_append(struct buffer *buf, const char *bytes, size_t len);
+void buffer_free(struct buffer *buf);
+
+#endif /* BUFFER_H */
@@ -0,0 +1,22 @@
+#include <stdio.h>
+
+#include "buffer.h"
+
+/*
+ * Reads standard input into a buffer and reports its size.
+ */
+int main(void)
+{
+    struct buffer buf = {0};
+    char chunk[4096];
+    size_t n;
+
+    puts("/* not a comment */");
+    puts("// nor this");
+    while ((n = fread(chunk, 1, sizeof(chunk), stdin)) > 0)
+        if (buffer_append(&buf, chunk, n))
+            return 1;
+    printf("%zu bytes\n", buf.len);
+    buffer_free(&buf);
+    return 0;
+}
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Checks the byte count reported for a known input
+set -e
+
+make buffer
+test "$(printf 'abc' | ./buffer)" = "3 bytes"
+echo ok
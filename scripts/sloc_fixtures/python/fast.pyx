@@ -0,0 +1,9 @@
+# cython: language_level=3
+"""Typed helpers."""
+
+
+def total(double[:] values):
+    cdef double result = 0
+    for value in values:
+        result += value
+    return result
@@ -0,0 +1,9 @@
+"""
+Sample package for comparing SLOC counters.
+
+The quotes in this docstring ' and " must not end it.
+"""
+
+from pkg.shapes import Circle, Square
+
+__all__ = ["Circle", "Square"]
@@ -0,0 +1,38 @@
+import math
+
+# A comment line
+QUOTE = '"'
+APOSTROPHE = "'"
+HASH = "# not a comment"
+
+
+class Shape:
+    """Base class."""
+
+    def area(self):
+        raise NotImplementedError
+
+
+class Circle(Shape):
+    """
+    A circle with a radius.
+    """
+
+    def __init__(self, radius):
+        self.radius = radius  # trailing comment
+
+    def area(self):
+        return math.pi * self.radius**2
+
+    def describe(self):
+        return """Circle of radius
+        %s""" % (self.radius,)
+
+
+class Square(Shape):
+    def __init__(self, side):
+        self.side = side
+
+    def area(self):
+        """Side squared."""
+        return self.side * self.side
@@ -0,0 +1,11 @@
+class Shape:
+    def area(self) -> float: ...
+
+class Circle(Shape):
+    radius: float
+    def __init__(self, radius: float) -> None: ...
+    def describe(self) -> str: ...
+
+class Square(Shape):
+    side: float
+    def __init__(self, side: float) -> None: ...
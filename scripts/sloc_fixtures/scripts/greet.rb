@@ -0,0 +1,7 @@
+# Greets each argument
+=begin
+Embedded documentation
+=end
+ARGV.each do |name|
+  puts "Hello, #{name}" # inline
+end
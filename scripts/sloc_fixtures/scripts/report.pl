@@ -0,0 +1,21 @@
+#!/usr/bin/perl
+use strict;
+use warnings;
+
+# Counts words per line
+while (my $line = <STDIN>) {
+    my @words = split ' ', $line;
+    print scalar(@words), "\n";
+}
+
+=head1 NAME
+
+report.pl - counts words
+
+=cut
+
+exit 0;
+
+__END__
+Anything after the end marker is documentation.
+print "not code\n";
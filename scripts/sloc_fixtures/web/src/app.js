@@ -0,0 +1,16 @@
+/**
+ * Renders a list of items.
+ */
+'use strict';
+
+const COMMENT = /\/\/ not a comment/;  // but this is
+
+function render(items) {
+  // Template literal spanning lines
+  return `<ul>
+    ${items.map((item) => `<li>${item}</li>`).join('')}
+  </ul>`;
+}
+
+/* single line block */
+module.exports = { render, COMMENT };
@@ -0,0 +1,5 @@
+// CommonJS configuration
+module.exports = {
+  url: 'http://example.com/*path*/',
+  retries: 3,
+};
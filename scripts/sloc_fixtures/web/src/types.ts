@@ -0,0 +1,10 @@
+// Item shown in the list
+export interface Item {
+  id: number;
+  /* display name */
+  name: string;
+}
+
+export function label(item: Item): string {
+  return `${item.id}: ${item.name}`;
+}
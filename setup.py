@@ -21,6 +21,7 @@ setup(
     url="https://github.com/llnl/scraper",
     packages=find_packages(),
     install_requires=install_reqs,
+    extras_require={"async": ["aiohttp"]},
     python_requires=">=3.6",
     entry_points={
         "console_scripts": [